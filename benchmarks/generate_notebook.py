@@ -0,0 +1,180 @@
+'''Write synthetic notebooks for benchmarks
+
+The notebooks look roughly like the ones I write papers in: markdown cells
+with LaTeX, raw cells, headings and code cells, some of which are marked with
+``# output->LaTeX`` and print a table, and many of which carry a large plot.
+Text is made from a fixed vocabulary (``WORDS``) with a few misspelled words
+mixed in, so that the spell checker benchmark can use a stub dictionary.
+
+Both the old (nbformat 3, ``worksheets``, ``input``, ``heading`` cells) and
+the current (nbformat 4) layout can be written. Cells are written one by
+one, so even notebooks with 100000 cells do not need much memory.
+
+Usage::
+
+    python benchmarks/generate_notebook.py 10000 test.ipynb --nbformat 3
+'''
+import json
+import random
+import base64
+import argparse
+
+WORDS = ('the a of and to in is we that for with as on this by are be from at '
+         'which an our model data star stars observed spectrum spectra emission '
+         'line lines fit temperature density plasma shock accretion disk stellar '
+         'wind magnetic field flux luminosity velocity figure table section show '
+         'shows shown result results value values error errors uncertainty '
+         'measure measured sample observation observations source sources '
+         'instrument resolution energy band ratio analysis region regions '
+         'also however because these those than higher lower large small mass '
+         'radius time period variability signal noise background count counts '
+         'power law component components fitted best parameter parameters').split()
+
+MISSPELLED = ['teh', 'obsevred', 'spectrm', 'temprature', 'lumniosity',
+              'analyis', 'resluts', 'becuase', 'paramter', 'masss']
+
+LATEX = [r'$T = 10^{6}$~K', r'\cite{2015ApJ...800...1G}', r'\ref{fig:spectrum}',
+         r'\emph{Chandra}', r'$\dot{M}$', r'\label{eq:flux}']
+
+
+def sentence(rng, misspell=0.01):
+    words = []
+    for i in range(rng.randint(8, 25)):
+        r = rng.random()
+        if r < misspell:
+            words.append(rng.choice(MISSPELLED))
+        elif r < misspell + 0.05:
+            words.append(rng.choice(LATEX))
+        else:
+            words.append(rng.choice(WORDS))
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, misspell):
+    return [sentence(rng, misspell) + '\n' for i in range(rng.randint(1, 6))]
+
+
+def finish_source(lines):
+    # notebooks do not end the last line of a cell with a newline
+    if lines:
+        lines[-1] = lines[-1].rstrip('\n')
+    return lines
+
+
+def make_cell(rng, celltype, nbformat, i, image_size, marked, misspell):
+    if celltype == 'markdown':
+        return {'cell_type': 'markdown', 'metadata': {},
+                'source': finish_source(paragraph(rng, misspell))}
+    if celltype == 'raw':
+        return {'cell_type': 'raw', 'metadata': {},
+                'source': finish_source([r'\begin{figure}' + '\n', r'\plotone{fig%d.eps}' % i + '\n',
+                                         r'\caption{' + sentence(rng, misspell) + '}\n',
+                                         r'\end{figure}' + '\n'])}
+    if celltype == 'heading':
+        level = rng.randint(2, 4)
+        title = ' '.join(rng.choice(WORDS) for j in range(3)).title() + ' {0}'.format(i)
+        if nbformat == 3:
+            return {'cell_type': 'heading', 'level': level, 'metadata': {}, 'source': [title]}
+        return {'cell_type': 'markdown', 'metadata': {}, 'source': ['#' * level + ' ' + title]}
+
+    # code cell
+    code = ['# output->LaTeX\n'] if marked else []
+    code += ['x = fit(data[{0}])\n'.format(i), 'print(x)']
+    outputs = []
+    stream = {'output_type': 'stream', 'name': 'stdout',
+              'text': ['\\begin{tabular}{lr}\n'] +
+                      ['{0} & {1:.3f} \\\\\n'.format(rng.choice(WORDS), rng.random())
+                       for j in range(rng.randint(3, 30))] + ['\\end{tabular}\n']}
+    if nbformat == 3:
+        stream['stream'] = stream.pop('name')
+    outputs.append(stream)
+    if image_size > 0 and not marked:
+        png = base64.b64encode(rng.getrandbits(8 * image_size).to_bytes(image_size, 'little')).decode('ascii')
+        if nbformat == 3:
+            outputs.append({'output_type': 'display_data', 'metadata': {}, 'png': png,
+                            'text': ['<matplotlib.figure.Figure at 0x10a3c5b50>']})
+        else:
+            outputs.append({'output_type': 'display_data', 'metadata': {},
+                            'data': {'image/png': png,
+                                     'text/plain': ['<Figure size 640x480 with 1 Axes>']}})
+    if nbformat == 3:
+        return {'cell_type': 'code', 'collapsed': False, 'input': code, 'language': 'python',
+                'metadata': {}, 'outputs': outputs, 'prompt_number': i}
+    return {'cell_type': 'code', 'execution_count': i, 'metadata': {},
+            'outputs': outputs, 'source': code}
+
+
+def write_notebook(filename, ncells, nbformat=4, mix=None, image_size=20000,
+                   marked_fraction=0.05, misspell=0.01, seed=42):
+    '''Write a synthetic notebook.
+
+    Parameters
+    ----------
+    filename : string
+    ncells : int
+        Number of cells.
+    nbformat : 3 or 4
+        Version of the notebook format.
+    mix : dict
+        Relative frequency of ``markdown``, ``raw``, ``heading`` and ``code``
+        cells.
+    image_size : int
+        Size (in bytes, before base64 encoding) of the plot attached to each
+        unmarked code cell. Set to 0 for no plots.
+    marked_fraction : float
+        Fraction of code cells that are marked with ``# output->LaTeX``.
+    misspell : float
+        Fraction of misspelled words in the text.
+    seed : int
+        Seed for the random number generator. The same parameters always
+        give the same notebook.
+    '''
+    if mix is None:
+        mix = {'markdown': 4, 'raw': 1, 'heading': 1, 'code': 4}
+    rng = random.Random(seed)
+    celltypes = sorted(mix)
+    weights = [mix[t] for t in celltypes]
+    # Start with a heading, so that --start can be tested
+    types = ['heading'] + rng.choices(celltypes, weights, k=ncells - 1)
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        if nbformat == 3:
+            f.write('{\n "metadata": {"name": ""},\n "nbformat": 3,\n "nbformat_minor": 0,\n'
+                    ' "worksheets": [\n  {\n   "cells": [\n')
+        else:
+            f.write('{\n "cells": [\n')
+        for i, celltype in enumerate(types[:ncells]):
+            cell = make_cell(rng, celltype, nbformat, i, image_size,
+                             rng.random() < marked_fraction, misspell)
+            if i > 0:
+                f.write(',\n')
+            f.write(json.dumps(cell, indent=1, sort_keys=True, ensure_ascii=False))
+        if nbformat == 3:
+            f.write('\n   ],\n   "metadata": {}\n  }\n ]\n}\n')
+        else:
+            f.write('\n ],\n "metadata": {},\n "nbformat": 4,\n "nbformat_minor": 4\n}\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic notebook for benchmarks.')
+    parser.add_argument('ncells', type=int, help='number of cells')
+    parser.add_argument('filename', help='output notebook')
+    parser.add_argument('--nbformat', type=int, choices=[3, 4], default=4)
+    parser.add_argument('--mix', default='markdown:4,raw:1,heading:1,code:4',
+                        help='relative frequency of cell types, e.g. "markdown:4,raw:1,heading:1,code:4"')
+    parser.add_argument('--image_size', type=int, default=20000,
+                        help='size of the plot in each unmarked code cell in bytes')
+    parser.add_argument('--marked_fraction', type=float, default=0.05,
+                        help='fraction of code cells marked with "# output->LaTeX"')
+    parser.add_argument('--misspell', type=float, default=0.01,
+                        help='fraction of misspelled words')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    mix = dict((k, float(v)) for k, v in (item.split(':') for item in args.mix.split(',')))
+    write_notebook(args.filename, args.ncells, nbformat=args.nbformat, mix=mix,
+                   image_size=args.image_size, marked_fraction=args.marked_fraction,
+                   misspell=args.misspell, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
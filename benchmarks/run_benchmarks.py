@@ -0,0 +1,205 @@
+'''Benchmarks for the converter and the spell checker
+
+Run with::
+
+    python benchmarks/run_benchmarks.py --cells 10 1000 10000 --label my-change
+
+For each benchmark, notebook size and notebook format a synthetic notebook
+is generated (see ``generate_notebook.py``) and the benchmark runs in a
+fresh python process, so that the peak memory (RSS) of each run can be
+measured. The best of ``--repeat`` runs is reported and appended to a
+results file (one JSON record per line), together with the version of the
+code it was run with. ``--compare`` prints all stored results side by side,
+so changes can be compared with earlier versions.
+
+Benchmarks:
+
+- ``convert``: ``NotebookConverter.convert`` on the whole notebook.
+- ``spellcheck``: spell check all markdown, raw and heading cells, the way
+  ``jupyterspellcheck`` does, but without asking about each word.
+- ``spellcheck_report``: the same check as ``jupyterspellcheck --report``.
+
+The spell checker benchmarks need pyenchant, but not the Enchant
+dictionaries, because they use a stub dictionary that knows the vocabulary
+of the synthetic notebooks.
+'''
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import generate_notebook
+
+BENCHMARKS = ['convert', 'spellcheck', 'spellcheck_report']
+
+
+class StubDict(object):
+    '''Minimal stand-in for ``enchant.Dict`` that knows the benchmark vocabulary.'''
+    tag = 'en_US'
+
+    def __init__(self):
+        self.words = set(generate_notebook.WORDS)
+
+    def check(self, word):
+        return word.lower() in self.words
+
+    def suggest(self, word):
+        return sorted(w for w in self.words if w[0] == word[0].lower())[:5]
+
+    def add(self, word):
+        self.words.add(word.lower())
+
+    def store_replacement(self, word, replacement):
+        pass
+
+
+def bench_convert(filename, workdir):
+    from ipythontools.jupyter2article import NotebookConverter
+    NotebookConverter().convert(filename, os.path.join(workdir, 'out.tex'))
+
+
+def bench_spellcheck(filename, workdir):
+    import enchant.checker
+    from ipythontools.nbreader import NotebookReader
+    from ipythontools.spellchecker import LatexChunker, LatexCommandFilter, TEXTCELLS
+    chkr = enchant.checker.SpellChecker(StubDict(), chunkers=[LatexChunker],
+                                        filters=[LatexCommandFilter])
+    # Read the notebook like jupyterspellcheck does
+    with open(filename, 'rb') as f:
+        cells = list(NotebookReader(f, needs_outputs=lambda cell: False, record_sources=True))
+    for cell in cells:
+        if cell.cell_type in TEXTCELLS:
+            chkr.set_text(''.join(cell.source))
+            for err in chkr:
+                err.suggest()
+
+
+def bench_spellcheck_report(filename, workdir):
+    from ipythontools.nbreader import NotebookReader
+    from ipythontools.spellchecker import WordChecker, find_misspellings, get_tokenizer
+    with open(filename, 'rb') as f:
+        find_misspellings(NotebookReader(f, needs_outputs=lambda cell: False),
+                          WordChecker(StubDict()), get_tokenizer('en_US'))
+
+
+def run_child(benchmark, filename):
+    '''Run one benchmark in this process and print the result as JSON.'''
+    workdir = tempfile.mkdtemp()
+    func = globals()['bench_' + benchmark]
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        func(filename, workdir)
+        wall = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on Mac, kB on Linux
+        rss = rss / 1024
+    print(json.dumps({'wall': wall, 'peak_rss_mb': rss / 1024.}))
+
+
+def code_version():
+    '''Describe the checked out version of the code.'''
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(args):
+    version = code_version()
+    label = args.label or version
+    workdir = args.notebook_dir or tempfile.mkdtemp()
+    records = []
+    print('{0:<17} {1:>3} {2:>8} {3:>10} {4:>10} {5:>12}'.format(
+        'benchmark', 'nb', 'cells', 'wall [s]', 'RSS [MB]', 'cells/s'))
+    for nbformat in args.nbformat:
+        for ncells in args.cells:
+            filename = os.path.join(workdir, 'bench_v{0}_{1}_{2}.ipynb'.format(nbformat, ncells, args.image_size))
+            if not os.path.exists(filename):
+                generate_notebook.write_notebook(filename, ncells, nbformat=nbformat,
+                                                 image_size=args.image_size)
+            for benchmark in args.benchmarks:
+                results = []
+                for i in range(args.repeat):
+                    proc = subprocess.run([sys.executable, __file__, '--child', benchmark, filename],
+                                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    if proc.returncode != 0:
+                        print('{0:<17} failed: {1}'.format(benchmark, proc.stderr.decode().strip().splitlines()[-1]))
+                        break
+                    results.append(json.loads(proc.stdout.decode().strip().splitlines()[-1]))
+                if not results:
+                    continue
+                record = {'benchmark': benchmark, 'nbformat': nbformat, 'cells': ncells,
+                          'image_size': args.image_size, 'bytes': os.path.getsize(filename),
+                          'wall': min(r['wall'] for r in results),
+                          'peak_rss_mb': min(r['peak_rss_mb'] for r in results),
+                          'version': version, 'label': label, 'time': time.time()}
+                record['cells_per_s'] = ncells / record['wall']
+                records.append(record)
+                print('{benchmark:<17} {nbformat:>3} {cells:>8} {wall:>10.3f} {peak_rss_mb:>10.1f} {cells_per_s:>12.0f}'.format(**record))
+
+    if args.output:
+        with open(args.output, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+
+def compare(args):
+    with open(args.output) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    labels = []
+    table = {}
+    for r in records:
+        if r['label'] not in labels:
+            labels.append(r['label'])
+        # later runs with the same label replace earlier ones
+        table[(r['benchmark'], r['nbformat'], r['cells'], r['image_size'], r['label'])] = r
+    keys = sorted(set(k[:4] for k in table))
+    print('Wall time [s] / peak RSS [MB]')
+    print('{0:<30}'.format('benchmark nb cells') + ''.join('{0:>22}'.format(l[:21]) for l in labels))
+    for key in keys:
+        row = '{0:<30}'.format('{0} v{1} {2}'.format(*key))
+        for label in labels:
+            r = table.get(key + (label,))
+            row += '{0:>22}'.format('-' if r is None else '{0:.3f} / {1:.0f}'.format(r['wall'], r['peak_rss_mb']))
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the notebook converter and spell checker.')
+    parser.add_argument('--cells', type=int, nargs='+', default=[10, 1000, 10000],
+                        help='notebook sizes (number of cells)')
+    parser.add_argument('--nbformat', type=int, nargs='+', choices=[3, 4], default=[4, 3])
+    parser.add_argument('--image_size', type=int, default=20000,
+                        help='size of the plot in each unmarked code cell in bytes')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--label', help='name for this set of results (default: git describe)')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results.jsonl'),
+                        help='append results to this file')
+    parser.add_argument('--notebook_dir', help='keep generated notebooks in this directory')
+    parser.add_argument('--compare', action='store_true', help='print stored results side by side')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(*args.child)
+    elif args.compare:
+        compare(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
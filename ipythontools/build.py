@@ -0,0 +1,360 @@
+r'''Build a paper from several notebooks
+
+Longer papers (and my thesis) do not fit into a single notebook. I keep one
+notebook per chapter, convert each of them to LaTeX and pull them together
+in a main file with ``\input``. Running ``jupyter2article`` on every
+notebook by hand gets old quickly, so ``ipythontools-build`` does it from a
+manifest, a JSON file like this::
+
+    {
+     "main": {"outfile": "paper.tex",
+              "file_before": "header.tex", "file_after": "footer.tex"},
+     "targets": [
+      {"infile": "intro.ipynb", "outfile": "intro.tex"},
+      {"infile": "analysis.ipynb", "outfile": "analysis.tex",
+       "start": "The paper starts here", "stop": "sect:todo"},
+      {"infile": "analysis.ipynb", "outfile": "appendix.tex",
+       "start": "sect:appendix"}
+     ]
+    }
+
+Each target holds the arguments for ``NotebookConverter.convert``
+(``infile``, ``outfile`` and optionally ``start``, ``stop``,
+``file_before`` and ``file_after``). Filenames are relative to the
+directory of the manifest. The main file is optional; it gets the
+content of its ``file_before``, an ``\input`` line for every target and
+the content of its ``file_after``.
+
+Then run::
+
+    > ipythontools-build paper.json
+
+The build remembers a hash of every input (the notebook and the template
+files) and of the settings of each target and the converter in
+``paper.build.json``. The next time, only targets where any of those
+changed (or where the output was changed or deleted) are converted again,
+so editing one chapter does not convert all the others. Targets that come
+from the same notebook are converted in one pass through it, and the
+notebooks are converted in parallel, see ``NotebookConverter.convert_many``.
+
+Labels, references and citations of all notebooks (and templates) are
+checked together after each build, so a reference to a label in another
+chapter is fine, but a label that is used in two chapters is reported.
+The index of each notebook is kept in the state file, so notebooks that
+are up to date do not have to be read for that.
+'''
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict
+
+from .jupyter2article import NotebookConverter
+from .cache import converter_config
+from .fileutils import AtomicWriter
+from .crossref import CrossrefIndex
+
+_TARGETKEYS = ('infile', 'outfile', 'start', 'stop', 'file_before', 'file_after')
+_MAINKEYS = ('outfile', 'file_before', 'file_after')
+_FILEKEYS = ('infile', 'outfile', 'file_before', 'file_after')
+
+
+def read_manifest(filename):
+    '''Read a manifest and make all filenames in it absolute.
+
+    Raises
+    ------
+    ValueError
+        If the manifest is not valid.
+    '''
+    with open(filename, 'r', encoding='utf-8') as f:
+        try:
+            manifest = json.load(f)
+        except ValueError as e:
+            raise ValueError('{0} is not valid JSON: {1}'.format(filename, e))
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('targets'), list):
+        raise ValueError('{0} needs a list of "targets".'.format(filename))
+    basedir = os.path.dirname(os.path.abspath(filename))
+
+    def resolve(entry, allowed, required):
+        if not isinstance(entry, dict):
+            raise ValueError('Entries in {0} need to be objects, not {1!r}.'.format(filename, entry))
+        unknown = set(entry) - set(allowed)
+        if unknown:
+            raise ValueError('Unknown keys in {0}: {1}'.format(filename, ', '.join(sorted(unknown))))
+        for key in required:
+            if key not in entry:
+                raise ValueError('Every target in {0} needs "{1}".'.format(filename, key))
+        entry = dict(entry)
+        for key in _FILEKEYS:
+            if entry.get(key) is not None:
+                entry[key] = os.path.normpath(os.path.join(basedir, entry[key]))
+        return entry
+
+    targets = [resolve(t, _TARGETKEYS, ('infile', 'outfile')) for t in manifest['targets']]
+    outfiles = [t['outfile'] for t in targets]
+    main = manifest.get('main')
+    if main is not None:
+        main = resolve(main, _MAINKEYS, ('outfile',))
+        outfiles.append(main['outfile'])
+    if len(set(outfiles)) != len(outfiles):
+        raise ValueError('The same outfile appears more than once in {0}.'.format(filename))
+    return {'main': main, 'targets': targets}
+
+
+class BuildState(object):
+    '''Remember what went into each target of the last build.
+
+    The state is kept in a small JSON file. To avoid reading every notebook
+    again just to find out that it did not change, the hash of each file is
+    stored together with its modification time and size and only
+    calculated again if those changed.
+
+    The state also holds the ``CrossrefIndex`` of each group of targets
+    (see ``ProjectBuilder.groups``) in ``crossref``.
+
+    Parameters
+    ----------
+    filename : string
+        Name of the state file.
+    '''
+    version = 2
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.files = {}
+        self.targets = {}
+        self.crossref = {}
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (IOError, ValueError):
+            return
+        if stored.get('version') == self.version:
+            self.files = stored['files']
+            self.targets = stored['targets']
+            self.crossref = stored['crossref']
+
+    def filehash(self, filename):
+        '''Return the SHA1 hash of a file or ``None`` if it does not exist.'''
+        try:
+            st = os.stat(filename)
+        except OSError:
+            self.files.pop(filename, None)
+            return None
+        stamp = [st.st_mtime_ns, st.st_size]
+        known = self.files.get(filename)
+        if (known is not None) and (known[:2] == stamp):
+            return known[2]
+        sha = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                sha.update(chunk)
+        self.files[filename] = stamp + [sha.hexdigest()]
+        return sha.hexdigest()
+
+    def save(self):
+        with AtomicWriter(self.filename, encoding='utf-8') as f:
+            json.dump({'version': self.version, 'files': self.files, 'targets': self.targets,
+                       'crossref': self.crossref}, f, indent=1, sort_keys=True)
+
+
+class ProjectBuilder(object):
+    '''Convert the notebooks in a manifest, but only those that changed.
+
+    Parameters
+    ----------
+    manifest : string
+        Filename of the manifest (see the module docstring).
+    converter : ``NotebookConverter`` or None
+        Converter for all targets.
+    statefile : string or None
+        Where to keep the state of the last build. By default, next to the
+        manifest (``paper.json`` -> ``paper.build.json``).
+    '''
+    def __init__(self, manifest, converter=None, statefile=None):
+        self.manifestfile = manifest
+        self.manifest = read_manifest(manifest)
+        self.converter = NotebookConverter() if converter is None else converter
+        if statefile is None:
+            statefile = os.path.splitext(manifest)[0] + '.build.json'
+        self.state = BuildState(statefile)
+
+    def settings(self, target):
+        '''Hash everything that changes the output of ``target``, except the input files.'''
+        config = [BuildState.version,
+                  [(t, converter_config(c)) for t, c in sorted(self.converter.cellconverters.items())],
+                  [(key, target.get(key)) for key in _TARGETKEYS]]
+        text = json.dumps(config, sort_keys=True, default=repr)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def record(self, target):
+        '''Describe the inputs and output of ``target`` as they are now.'''
+        inputs = dict((target[key], self.state.filehash(target[key]))
+                      for key in ('infile', 'file_before', 'file_after')
+                      if target.get(key) is not None)
+        return {'settings': self.settings(target), 'inputs': inputs,
+                'output': self.state.filehash(target['outfile'])}
+
+    def stale(self):
+        '''Return the targets that need to be converted again.'''
+        stale = []
+        for target in self.manifest['targets']:
+            now = self.record(target)
+            if (now['output'] is None) or (self.state.targets.get(target['outfile']) != now):
+                stale.append(target)
+        return stale
+
+    def groups(self, targets):
+        '''Split ``targets`` into groups with the same notebook and templates.
+
+        The targets of one group are converted together, with a single pass
+        through the notebook (see ``NotebookConverter.convert_ranges``).
+        '''
+        groups = OrderedDict()
+        for target in targets:
+            key = (target['infile'], target.get('file_before'), target.get('file_after'))
+            groups.setdefault(key, []).append(target)
+        return list(groups.values())
+
+    @staticmethod
+    def groupkey(group):
+        '''Name of a group of targets in the state file.'''
+        return json.dumps([group[0]['infile'], group[0].get('file_before'),
+                           group[0].get('file_after')])
+
+    def job(self, group):
+        '''Return the arguments of ``convert_ranges`` for a group of targets.'''
+        job = dict((key, group[0][key]) for key in ('infile', 'file_before', 'file_after')
+                   if group[0].get(key) is not None)
+        job['ranges'] = [(t.get('start', 0), t.get('stop', 100000000), t['outfile']) for t in group]
+        return job
+
+    def crossref(self):
+        '''Return the ``CrossrefIndex`` of the whole project, from the last build of each notebook.'''
+        indexes = [self.state.crossref[self.groupkey(group)]
+                   for group in self.groups(self.manifest['targets'])
+                   if self.groupkey(group) in self.state.crossref]
+        main = self.manifest['main']
+        if main is not None:
+            index = CrossrefIndex(main['outfile'])
+            for key in ('file_before', 'file_after'):
+                if main.get(key) is not None:
+                    index.add_template(main[key], self.converter.read_template(main[key]))
+            indexes.append(index)
+        return CrossrefIndex.combine(indexes, name=self.manifestfile)
+
+    def build(self, force=False, workers=None, backend='process', log=None):
+        '''Convert all stale targets (or all, if ``force``) and write the main file.
+
+        If one target of a notebook is stale, all targets of that notebook
+        (with the same templates) are converted: The notebook has to be read
+        anyway, outputs that do not change are not written again, and the
+        labels of headings come out the same as in a full build.
+        See ``NotebookConverter.convert_many`` for ``workers`` and ``backend``.
+
+        Returns
+        -------
+        results : list of ``ConversionResult``
+            One for each group of targets that was converted.
+        '''
+        if log is None:
+            log = sys.stdout
+        stale = set(t['outfile'] for t in (self.manifest['targets'] if force else self.stale()))
+        groups = [group for group in self.groups(self.manifest['targets'])
+                  if any(t['outfile'] in stale for t in group)]
+        converted = set(t['outfile'] for group in groups for t in group)
+        for target in self.manifest['targets']:
+            if target['outfile'] not in converted:
+                print('Up to date ', target['outfile'], file=log)
+        # Inputs are hashed before converting. If a notebook is saved during
+        # the build, the next build sees that it changed.
+        records = dict((t['outfile'], self.record(t)) for group in groups for t in group)
+        results = []
+        if groups:
+            # Labels and references are checked for the whole project below.
+            # The workers may be processes, so each index comes back as a file.
+            tmpdir = tempfile.mkdtemp(prefix='ipythontools-build-')
+            jobs = [self.job(group) for group in groups]
+            for i, job in enumerate(jobs):
+                job.update(crossref=os.path.join(tmpdir, '{0}.json'.format(i)), warn=False)
+            try:
+                log.flush()
+                results = self.converter.convert_many(jobs, workers=workers, backend=backend)
+                for group, result in zip(groups, results):
+                    if result.error is None:
+                        with open(result.job['crossref'], 'r', encoding='utf-8') as f:
+                            self.state.crossref[self.groupkey(group)] = json.load(f)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        for group, result in zip(groups, results):
+            for target in group:
+                outfile = target['outfile']
+                if result.error is None:
+                    records[outfile]['output'] = self.state.filehash(outfile)
+                    self.state.targets[outfile] = records[outfile]
+                else:
+                    self.state.targets.pop(outfile, None)
+            if result.error is not None:
+                self.state.crossref.pop(self.groupkey(group), None)
+                print('Converting {0} failed: {1}'.format(result.job['infile'], result.error),
+                      file=sys.stderr)
+        # Forget targets that were removed from the manifest
+        for outfile in set(self.state.targets) - set(t['outfile'] for t in self.manifest['targets']):
+            del self.state.targets[outfile]
+        groupkeys = set(self.groupkey(group) for group in self.groups(self.manifest['targets']))
+        for key in set(self.state.crossref) - groupkeys:
+            del self.state.crossref[key]
+        self.state.save()
+        for message in self.crossref().messages():
+            print(message, file=log)
+        if self.manifest['main'] is not None:
+            self.write_main(log)
+        return results
+
+    def write_main(self, log=None):
+        r'''Write the main file that ``\input``\s all targets.'''
+        main = self.manifest['main']
+        maindir = os.path.dirname(main['outfile'])
+        parts = []
+        if main.get('file_before') is not None:
+            parts.append(self.converter.read_template(main['file_before']))
+        for target in self.manifest['targets']:
+            name = os.path.relpath(target['outfile'], maindir).replace(os.sep, '/')
+            if name.endswith('.tex'):
+                name = name[:-4]
+            parts.append('\\input{{{0}}}\n'.format(name))
+        if main.get('file_after') is not None:
+            parts.append(self.converter.read_template(main['file_after']))
+        writer = AtomicWriter(main['outfile'], encoding='utf-8')
+        with writer as out:
+            out.write(''.join(parts))
+        print('Writing ' if writer.changed else 'No changes in ', main['outfile'], file=log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='''Convert the notebooks listed in a manifest to LaTeX, but only those that changed since the last build, and write a main file that includes them all.''')
+    parser.add_argument('manifest', help='JSON file that lists the notebooks and output files.')
+    parser.add_argument('--force', action='store_true', help='Convert all targets, even those that are up to date.')
+    parser.add_argument('--dry_run', action='store_true', help='Only list the targets that would be converted.')
+    parser.add_argument('--workers', type=int, help='Number of notebooks that are converted at the same time (default: one per CPU core).')
+    parser.add_argument('--state', help='File that keeps the state of the last build (default: the name of the manifest with .build.json instead of .json).')
+    args = parser.parse_args()
+
+    try:
+        builder = ProjectBuilder(args.manifest, statefile=args.state)
+    except (IOError, ValueError) as e:
+        parser.error(str(e))
+    if args.dry_run:
+        for target in builder.manifest['targets'] if args.force else builder.stale():
+            print(target['outfile'])
+        sys.exit()
+    results = builder.build(force=args.force, workers=args.workers)
+    sys.exit(1 if any(r.error is not None for r in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
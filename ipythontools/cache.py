@@ -0,0 +1,154 @@
+'''Cache converted cells, so that only edited cells are converted again
+
+In a long notebook, most cells do not change between two runs of
+``jupyter2article``. ``ConversionCache`` stores the document nodes (see
+``document``) produced for each cell, using a hash of the cell content and
+the configuration of the converter as key. When the same cell is converted with the same converter again, the
+stored nodes are reused for every output format. Only the parts of a cell
+that can end up in the output go into the key, so running the notebook
+again (which changes execution counts and the metadata of outputs) does
+not make the cached nodes useless.
+
+The cache is kept in a single JSON file. When it grows beyond ``maxsize``
+the entries that have not been used for the longest time are dropped.
+'''
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .fileutils import AtomicWriter
+from .nbreader import NotebookReader
+from .document import load_nodes
+
+_IGNORED_KEYS = ('id', 'metadata', 'execution_count', 'prompt_number', 'collapsed', 'outputs')
+'''Keys of a cell that do not change its conversion (outputs are added separately).'''
+
+_OUTPUT_KEYS = ('output_type', 'text', 'latex', 'data')
+'''Keys of an output that the cell converters use.'''
+
+
+def converter_config(converter):
+    '''Describe a cell converter (its class and attributes) for hashing with ``json.dumps``.'''
+    return [type(converter).__module__, type(converter).__name__,
+            getattr(converter, '__dict__', {})]
+
+
+def _entrysize(nodes):
+    size = 100
+    for node in nodes:
+        for field in node:
+            if isinstance(field, list):
+                size += sum(len(line) for line in field)
+            else:
+                size += 10
+    return size
+
+
+class ConversionCache(object):
+    '''Store the converted nodes of cells.
+
+    Parameters
+    ----------
+    filename : string or None
+        The cache is read from this file (if it exists) and written to it
+        by ``save``. If ``None``, the cache only lives in memory.
+    maxsize : int
+        Approximate maximal size of the cache in bytes.
+    '''
+    version = 5
+
+    def __init__(self, filename=None, maxsize=2**25):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if (filename is not None) and os.path.exists(filename):
+            self.load()
+
+    def __getstate__(self):
+        # Locks cannot be pickled, e.g. to send the cache to a worker process
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''Read cache from ``filename``. Unreadable or broken caches are ignored.'''
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored.get('version') != self.version:
+                return
+            entries = []
+            for key, nodes in stored['entries']:
+                # Fails for entries that cannot be turned into nodes
+                load_nodes(nodes)
+                entries.append((str(key), nodes))
+        except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError):
+            return
+        with self._lock:
+            for key, nodes in entries:
+                self._store(key, nodes)
+
+    def save(self):
+        '''Write cache to ``filename``.'''
+        if self.filename is None:
+            return
+        with self._lock:
+            stored = {'version': self.version,
+                      'entries': list(self.entries.items())}
+        with AtomicWriter(self.filename, encoding='utf-8', only_if_changed=False) as f:
+            json.dump(stored, f)
+
+    def key(self, cell, converter):
+        '''Hash cell content and converter configuration.'''
+        content = dict((k, v) for k, v in cell.items() if k not in _IGNORED_KEYS)
+        outputs = []
+        for out in cell.get('outputs', []):
+            out = dict((k, v) for k, v in out.items() if k in _OUTPUT_KEYS)
+            if 'data' in out:
+                # Images and other formats are not even read, see ``NotebookReader``
+                out['data'] = dict((k, v) for k, v in out['data'].items()
+                                   if k in NotebookReader.output_mimetypes)
+            outputs.append(out)
+        if outputs:
+            content['outputs'] = outputs
+        text = json.dumps([converter_config(converter), content], sort_keys=True, default=repr)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''Return stored nodes for ``key`` or ``None``.'''
+        with self._lock:
+            nodes = self.entries.get(key)
+            if nodes is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(nodes)
+
+    def set(self, key, nodes):
+        with self._lock:
+            self._store(key, list(nodes))
+
+    def _store(self, key, nodes):
+        if key in self.entries:
+            self.size -= _entrysize(self.entries.pop(key))
+        self.entries[key] = nodes
+        self.size += _entrysize(nodes)
+        while self.size > self.maxsize and len(self.entries) > 0:
+            oldkey, oldnodes = self.entries.popitem(last=False)
+            self.size -= _entrysize(oldnodes)
+
+    def stats(self):
+        '''One line summary of cache use.'''
+        return 'Cache: {0} hits, {1} misses, {2} cells stored'.format(self.hits, self.misses,
+                                                                     len(self.entries))
@@ -0,0 +1,59 @@
+'''Talk to a running ``ipythontools-server``
+
+This module only uses the standard library and imports nothing else from
+this package, so that asking the server for a conversion is as cheap as
+possible. See ``server.py`` for the protocol.
+'''
+import os
+import json
+import socket
+import tempfile
+
+
+def default_socket():
+    '''Return the default path of the server socket for this user.'''
+    dirname = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    if not hasattr(os, 'getuid'):
+        # No user ids (Windows), but the temporary directory is per user there
+        return os.path.join(dirname, 'ipythontools.sock')
+    return os.path.join(dirname, 'ipythontools-{0}.sock'.format(os.getuid()))
+
+
+def request(command, path=None, **args):
+    '''Send a request to the server and return its result.
+
+    Parameters
+    ----------
+    command : string
+        ``'convert'``, ``'check'``, ``'ping'`` or ``'shutdown'``.
+    path : string or None
+        Socket of the server (default: ``default_socket()``).
+    args :
+        Arguments of the command. Filenames must be absolute, because the
+        server runs in a different directory.
+
+    Raises
+    ------
+    OSError
+        If no server is running.
+    RuntimeError
+        If the server could not do what it was asked.
+    '''
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError('Unix domain sockets are not available on this platform.')
+    if path is None:
+        path = default_socket()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps({'command': command, 'args': args}).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise ConnectionError('Server at {0} closed the connection.'.format(path))
+    response = json.loads(line.decode('utf-8'))
+    if not response['ok']:
+        raise RuntimeError(response['error'])
+    return response['result']
@@ -0,0 +1,213 @@
+r'''Check labels, references and citations before LaTeX is run
+
+LaTeX only complains about a ``\ref`` to a label that does not exist (or a
+label that is defined twice) after it ran at least twice, and it does not
+say in which cell of the notebook the problem is. Since the converter
+looks at every cell anyway, ``CrossrefIndex`` collects all labels
+(generated for headings and written by hand with ``\label``), references
+(``\ref``, ``\eqref``, ``\autoref``, ...) and citations (``\cite``,
+``\citet``, ...) in the same pass and reports:
+
+- labels that are defined in more than one cell,
+- references to labels that are not defined anywhere,
+- citations that are not in any of the ``.bib`` files (if there are any).
+
+Labels and references in the ``file_before`` and ``file_after`` templates
+count, too. ``ipythontools-build`` combines the indexes of all notebooks
+of a project (see ``CrossrefIndex.combine``), so that a reference to a
+label in another chapter is not reported and a label that is defined in
+two chapters is.
+
+Labels for headings are generated from the title, so two sections called
+"Results" would both get ``sect:results``. Instead, the second one gets
+``sect:results-2`` (the third ``sect:results-3``, etc.). The first heading
+with that title keeps the plain label, so the labels only change if the
+order of the headings changes.
+'''
+import re
+import json
+
+from .document import Heading
+
+_COMMENT = re.compile(r'(?<!\\)%.*')
+_KEYS = re.compile(r'\\(label|(?:eq|page|auto|name|sub|c|C|v|V)?ref|[a-zA-Z]*cite[a-zA-Z]*)\*?'
+                   r'(?:\[[^\]]*\])*\{([^}]*)\}')
+_BIBENTRY = re.compile(r'@\s*([a-zA-Z]+)\s*[{(]\s*([^,\s]+)\s*,')
+
+
+def _where(locations):
+    '''Format a list of cell numbers and other locations (e.g. template files).'''
+    cells = [str(loc) for loc in locations if isinstance(loc, int)]
+    where = [loc for loc in locations if not isinstance(loc, int)]
+    if cells:
+        where.insert(0, 'cell{0} {1}'.format('s' if len(cells) > 1 else '', ', '.join(cells)))
+    return ', '.join(where)
+
+
+def read_bibkeys(filenames):
+    '''Return the set of all citation keys in the ``.bib`` files ``filenames``.'''
+    keys = set()
+    for filename in filenames:
+        with open(filename, 'r', encoding='utf-8', errors='replace') as f:
+            for kind, key in _BIBENTRY.findall(f.read()):
+                if kind.lower() not in ('string', 'comment', 'preamble'):
+                    keys.add(key)
+    return keys
+
+
+class CrossrefIndex(object):
+    '''Index of labels, references and citations in a notebook.
+
+    Parameters
+    ----------
+    notebook : string
+        Name of the notebook, used in the messages.
+
+    Attributes
+    ----------
+    labels, refs, cites : dict
+        Number of each cell (in the notebook) that defines, references or
+        cites a key, by key. Keys in templates are listed with the name of
+        the template instead of a cell number.
+    renamed : list
+        ``(cell, label, newlabel)`` for each generated label that was
+        changed to avoid a collision.
+    '''
+    def __init__(self, notebook='<stream>'):
+        self.notebook = notebook
+        self.labels = {}
+        self.refs = {}
+        self.cites = {}
+        self.renamed = []
+        self.templates = []
+
+    def add(self, i, nodes):
+        '''Add the nodes of cell number ``i`` to the index.
+
+        Returns the nodes, with the labels of headings changed where they
+        collide with labels that were defined before.
+        '''
+        out = nodes
+        for j, node in enumerate(nodes):
+            if isinstance(node, Heading):
+                label = node.label
+                if label in self.labels:
+                    n = 2
+                    while '{0}-{1}'.format(node.label, n) in self.labels:
+                        n += 1
+                    label = '{0}-{1}'.format(node.label, n)
+                    self.renamed.append((i, node.label, label))
+                    if out is nodes:
+                        out = list(nodes)
+                    out[j] = node._replace(label=label)
+                self.labels.setdefault(label, []).append(i)
+            elif isinstance(getattr(node, 'lines', None), list):
+                text = ''.join(node.lines)
+                if '\\' in text:
+                    if '%' in text:
+                        text = _COMMENT.sub('', text)
+                    self._scan(i, text)
+        return out
+
+    def add_template(self, filename, text):
+        '''Add the labels and references in a template file (e.g. ``file_before``).'''
+        if filename not in self.templates:
+            self.templates.append(filename)
+            self._scan(filename, _COMMENT.sub('', text))
+
+    @classmethod
+    def combine(cls, indexes, name='<project>'):
+        '''Combine the indexes of several notebooks into one, e.g. for a whole paper.
+
+        Parameters
+        ----------
+        indexes : list
+            ``CrossrefIndex`` objects or what their ``as_dict`` returned.
+        name : string
+            Name used in the messages.
+
+        Cells in the combined index are called ``"notebook cell i"``.
+        A template that is used for several notebooks is only counted once.
+        '''
+        combined = cls(name)
+        for index in indexes:
+            if isinstance(index, CrossrefIndex):
+                index = index.as_dict()
+            where = lambda loc: loc if not isinstance(loc, int) else \
+                '{0} cell {1}'.format(index['notebook'], loc)
+            templates = [t for t in index.get('templates', []) if t not in combined.templates]
+            combined.templates.extend(templates)
+            for attr in ('labels', 'refs', 'cites'):
+                combinedkeys = getattr(combined, attr)
+                for key, locations in index[attr].items():
+                    locations = [where(loc) for loc in locations
+                                 if isinstance(loc, int) or loc in templates]
+                    if locations:
+                        combinedkeys.setdefault(key, []).extend(locations)
+            for p in index['problems']:
+                if p['problem'] == 'renamed label':
+                    combined.renamed.append((where(p['cells'][0]), p['key'], p['newkey']))
+        return combined
+
+    def _scan(self, i, text):
+        for command, keys in _KEYS.findall(text):
+            if command == 'label':
+                index = self.labels
+                keys = [keys.strip()]
+            else:
+                index = self.cites if 'cite' in command else self.refs
+                keys = [key.strip() for key in keys.split(',')]
+            for key in keys:
+                if key:
+                    cells = index.setdefault(key, [])
+                    # Cells are added in order. A label is listed as often as it
+                    # is defined, everything else once per cell.
+                    if (index is self.labels) or (not cells) or (cells[-1] != i):
+                        cells.append(i)
+
+    def problems(self, bibkeys=None):
+        '''Return a list of problems, each a dict with ``problem``, ``key`` and ``cells``.
+
+        Citations are only checked if ``bibkeys`` (see ``read_bibkeys``) is given.
+        '''
+        problems = [{'problem': 'renamed label', 'key': label, 'newkey': newlabel, 'cells': [i]}
+                    for i, label, newlabel in self.renamed]
+        for key in sorted(self.labels):
+            if len(self.labels[key]) > 1:
+                problems.append({'problem': 'duplicate label', 'key': key, 'cells': self.labels[key]})
+        for key in sorted(self.refs):
+            if key not in self.labels:
+                problems.append({'problem': 'undefined reference', 'key': key, 'cells': self.refs[key]})
+        if bibkeys is not None:
+            for key in sorted(self.cites):
+                if key not in bibkeys:
+                    problems.append({'problem': 'undefined citation', 'key': key, 'cells': self.cites[key]})
+        return problems
+
+    def messages(self, bibkeys=None):
+        '''Return the problems as a list of human readable warnings.'''
+        messages = []
+        for p in self.problems(bibkeys):
+            cells = _where(p['cells'])
+            if p['problem'] == 'renamed label':
+                text = 'Label {key} is already used, so the heading in {cells} gets {newkey}.'
+            elif p['problem'] == 'duplicate label':
+                text = 'Label {key} is defined more than once ({cells}).'
+            elif p['problem'] == 'undefined reference':
+                text = 'Reference to undefined label {key} ({cells}).'
+            else:
+                text = 'Citation {key} is not in the bibliography ({cells}).'
+            messages.append('Warning: {0}: '.format(self.notebook) +
+                            text.format(key=p['key'], newkey=p.get('newkey'), cells=cells))
+        return messages
+
+    def as_dict(self, bibkeys=None):
+        '''Return the index and its problems for ``json.dump``.'''
+        return {'notebook': self.notebook, 'labels': self.labels, 'refs': self.refs,
+                'cites': self.cites, 'templates': self.templates,
+                'problems': self.problems(bibkeys)}
+
+    def write(self, outfile, bibkeys=None):
+        '''Write the index as JSON.'''
+        with open(outfile, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(bibkeys), f, indent=1, sort_keys=True)
@@ -0,0 +1,256 @@
+r'''A small document model between notebook cells and output files
+
+The cell converters in ``jupyter2article`` do not write LaTeX directly.
+Instead, each cell is turned into a short list of nodes:
+
+- ``Heading``: a section title with its level and label,
+- ``Paragraph``: lines of text (which, in my notebooks, contain LaTeX
+  commands like ``\cite``),
+- ``LatexBlock``: LaTeX that is copied verbatim, e.g. a raw cell with a figure,
+- ``CodeOutput``: the output of a code cell, e.g. a table,
+- ``BlankLines``: empty lines between the parts.
+
+An emitter turns these nodes into the text of one output format. Because
+the notebook is only read and converted once, a LaTeX file, a plain text
+version (for word counts and grammar checkers) and a Markdown preview can
+all be written from a single pass through a large notebook.
+
+Cell converters written before this model can still return LaTeX as a
+string or a list of lines; ``as_nodes`` turns that into a ``LatexBlock``.
+'''
+import os
+import re
+import hashlib
+from collections import namedtuple
+
+from .fileutils import AtomicWriter
+
+Heading = namedtuple('Heading', ['level', 'title', 'label', 'command'])
+'''Section title; ``command`` is the LaTeX sectioning command, e.g. ``section``.'''
+Paragraph = namedtuple('Paragraph', ['lines'])
+LatexBlock = namedtuple('LatexBlock', ['lines'])
+CodeOutput = namedtuple('CodeOutput', ['lines'])
+BlankLines = namedtuple('BlankLines', ['count'])
+
+NODETYPES = dict((t.__name__, t) for t in [Heading, Paragraph, LatexBlock, CodeOutput, BlankLines])
+
+
+def as_nodes(result):
+    '''Turn what a cell converter returned into a list of nodes.
+
+    Strings (or runs of strings in a list) are taken to be LaTeX.
+    '''
+    if isinstance(result, str):
+        return [LatexBlock([result])]
+    nodes = []
+    lines = None
+    for item in result:
+        if isinstance(item, str):
+            if lines is None:
+                lines = []
+                nodes.append(LatexBlock(lines))
+            lines.append(item)
+        else:
+            nodes.append(item)
+            lines = None
+    return nodes
+
+
+def dump_nodes(nodes):
+    '''Turn nodes into lists that can be stored as JSON.'''
+    return [[type(node).__name__] + list(node) for node in nodes]
+
+
+def load_nodes(data):
+    '''Inverse of ``dump_nodes``.'''
+    return [NODETYPES[item[0]](*item[1:]) for item in data]
+
+
+class Emitter(object):
+    '''Base class for emitters.
+
+    Subclasses define one method for each node type (named like the type,
+    but in lower case) that returns the text for that node.
+    '''
+    def emit(self, nodes):
+        '''Return the text for a list of nodes.'''
+        return ''.join([getattr(self, type(node).__name__.lower())(node) for node in nodes])
+
+
+class LatexEmitter(Emitter):
+    r'''Write LaTeX.
+
+    Parameters
+    ----------
+    spill_size : int or None
+        Code output with more characters than this (e.g. a long table) is
+        written to a file of its own and included with ``\input``, so that
+        the main LaTeX file stays small enough for an editor.
+        ``None`` keeps all output in the main file.
+    spill_prefix : string
+        Path and start of the names of those files. The name ends in a hash
+        of the content, so unchanged output keeps its file. The ``\input``
+        is relative to the directory of ``spill_prefix``, so LaTeX has to run
+        in that directory.
+
+    The files are not written right away, but kept until ``finish`` is
+    called, which should happen when the main LaTeX file is written, too.
+    '''
+    def __init__(self, spill_size=None, spill_prefix='output'):
+        self.spill_size = spill_size
+        self.spill_prefix = spill_prefix
+        self.spilled = []
+
+    def heading(self, node):
+        return '\\{0}{{{1}}}\n\\label{{{2}}}\n'.format(node.command, node.title, node.label)
+
+    def paragraph(self, node):
+        return ''.join(node.lines)
+
+    latexblock = paragraph
+
+    def codeoutput(self, node):
+        if self.spill_size is None:
+            return ''.join(node.lines)
+        size = 0
+        for line in node.lines:
+            size += len(line)
+            if size > self.spill_size:
+                break
+        else:
+            return ''.join(node.lines)
+        # The name depends on the content, so it is only known at the end
+        writer = AtomicWriter(self.spill_prefix + '.tex', encoding='utf-8')
+        sha = hashlib.sha1()
+        with _Pending(writer) as f:
+            for line in node.lines:
+                sha.update(line.encode('utf-8'))
+                f.write(line)
+        writer.filename = '{0}-{1}.tex'.format(self.spill_prefix, sha.hexdigest()[:12])
+        self.spilled.append(writer)
+        return '\\input{{{0}}}\n'.format(os.path.basename(writer.filename)[:-4])
+
+    def blanklines(self, node):
+        return '\n' * node.count
+
+    def finish(self, exc_type=None, exc_value=None, traceback=None):
+        '''Write the files for spilled output, or discard them if ``exc_type`` is given.
+
+        Files from earlier runs that are no longer used are removed. The
+        arguments are those of ``__exit__``, so this can be pushed onto a
+        ``contextlib.ExitStack``.
+        '''
+        spilled, self.spilled = self.spilled, []
+        for writer in spilled:
+            writer.__exit__(exc_type, exc_value, traceback)
+        if (exc_type is None) and (self.spill_size is not None):
+            dirname, prefix = os.path.split(os.path.abspath(self.spill_prefix))
+            used = set(os.path.basename(writer.filename) for writer in spilled)
+            pattern = re.compile(re.escape(prefix) + '-[0-9a-f]{12}\\.tex$')
+            for filename in os.listdir(dirname):
+                if pattern.match(filename) and (filename not in used):
+                    os.remove(os.path.join(dirname, filename))
+        return False
+
+
+class _Pending(object):
+    '''Write into an ``AtomicWriter``, but leave it to the caller to finish it.
+
+    The temporary file is closed at the end (so that many of them can be
+    pending), and removed right away if writing fails.
+    '''
+    def __init__(self, writer):
+        self.writer = writer
+
+    def __enter__(self):
+        return self.writer.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            return self.writer.__exit__(exc_type, exc_value, traceback)
+        self.writer.file.close()
+        return False
+
+
+_MATH = re.compile(r'\$\$.*?\$\$|\$.*?\$|\\\(.*?\\\)|\\\[.*?\\\]|'
+                   r'\\begin\{(equation|eqnarray|align|gather|multline)\*?\}.*?\\end\{\1\*?\}', re.DOTALL)
+_DROPPED = re.compile(r'~?\\(?:[a-zA-Z]*ref|cite[a-zA-Z]*|label|footnote|begin|end|includegraphics)\*?'
+                      r'(?:\[[^\]]*\])*\{[^}]*\}')
+_COMMAND = re.compile(r'\\[a-zA-Z]+\*?(?:\[[^\]]*\])*')
+_COMMENT = re.compile(r'(?<!\\)%.*')
+
+
+class TextEmitter(Emitter):
+    r'''Write plain text, e.g. for word counts or grammar checkers.
+
+    Headings, paragraphs and the prose in LaTeX blocks (e.g. the caption
+    of a figure in a raw cell) are kept, code output is dropped. Math,
+    references, citations, labels, environments and graphics are removed
+    and other LaTeX commands are replaced by their argument (so
+    ``\emph{word}`` becomes ``word``).
+    '''
+    def heading(self, node):
+        return node.title + '\n'
+
+    def paragraph(self, node):
+        text = ''.join(node.lines)
+        text = _COMMENT.sub('', text)
+        text = _MATH.sub('', text)
+        text = _DROPPED.sub('', text)
+        text = _COMMAND.sub('', text)
+        return text.replace('{', '').replace('}', '').replace('~', ' ')
+
+    latexblock = paragraph
+
+    def codeoutput(self, node):
+        return ''
+
+    def blanklines(self, node):
+        return '\n' * node.count
+
+
+def _fenced(lines, info=''):
+    text = ''.join(lines)
+    if not text.strip():
+        return ''
+    if not text.endswith('\n'):
+        text += '\n'
+    return '```' + info + '\n' + text + '```\n'
+
+
+class MarkdownEmitter(Emitter):
+    '''Write Markdown, e.g. for a quick preview.
+
+    LaTeX blocks and code output are put into fenced code blocks.
+    '''
+    def heading(self, node):
+        return '#' * node.level + ' ' + node.title + '\n'
+
+    def paragraph(self, node):
+        return ''.join(node.lines)
+
+    def latexblock(self, node):
+        return _fenced(node.lines, 'latex')
+
+    def codeoutput(self, node):
+        return _fenced(node.lines)
+
+    def blanklines(self, node):
+        return '\n' * node.count
+
+
+EMITTERS = {'latex': LatexEmitter(), 'text': TextEmitter(), 'markdown': MarkdownEmitter()}
+'''Emitters by name, e.g. for the ``--also`` option of ``jupyter2article``.'''
+
+
+def get_emitter(emitter):
+    '''Return emitter for a name in ``EMITTERS``, an ``Emitter`` or ``None`` (LaTeX).'''
+    if emitter is None:
+        return EMITTERS['latex']
+    if isinstance(emitter, str):
+        try:
+            return EMITTERS[emitter]
+        except KeyError:
+            raise ValueError('Unknown output format: {0} (known formats: {1})'.format(
+                emitter, ', '.join(sorted(EMITTERS))))
+    return emitter
@@ -0,0 +1,279 @@
+'''Helpers to write files safely
+
+Files are never written in place. Instead, everything goes into a temporary
+file in the same directory, which is moved over the target in one step once
+it is complete. If anything goes wrong while writing, the old file is still
+there. And if the new content is identical to the old file, the old file
+(and its modification time) is kept, so that tools like latexmk or an editor
+do not think something changed.
+
+``splice`` copies a file and replaces a few pieces of it on the way, which
+is much cheaper than decoding and writing out a large notebook just to
+change a couple of words.
+
+Notebooks full of plots compress well, so I keep old ones as
+``.ipynb.gz``, ``.ipynb.xz`` or ``.ipynb.zst``. ``open_notebook`` recognizes
+compressed files by their first bytes and decompresses them on the fly,
+no matter what they are called. ``splice`` reads them the same way and
+compresses its output if the name of ``outfile`` ends in ``.gz``, ``.xz``,
+``.bz2`` or ``.zst``. zstd needs the ``zstandard`` package (or Python 3.14).
+'''
+import os
+import sys
+import bz2
+import gzip
+import lzma
+import filecmp
+import tempfile
+
+try:
+    # Python >= 3.14
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_MAGIC = [(b'\x1f\x8b', 'gzip'), (b'\xfd7zXZ\x00', 'xz'), (b'BZh', 'bz2'),
+          (b'\x28\xb5\x2f\xfd', 'zstd')]
+_EXTENSIONS = {'.gz': 'gzip', '.xz': 'xz', '.bz2': 'bz2', '.zst': 'zstd'}
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+_UMASK = _umask()
+
+
+class AtomicWriter(object):
+    '''Context manager that writes a file atomically.
+
+    Use it like ``open``::
+
+        writer = AtomicWriter('paper.tex')
+        with writer as f:
+            f.write(text)
+        if writer.changed:
+            print('paper.tex was updated')
+
+    Parameters
+    ----------
+    filename : string
+        File to write.
+    mode : string
+        ``'w'`` or ``'wb'``.
+    encoding : string
+        Encoding for text files.
+    only_if_changed : bool
+        If ``True``, an existing file with the same content is left alone.
+    '''
+    def __init__(self, filename, mode='w', encoding=None, only_if_changed=True):
+        self.filename = filename
+        self.mode = mode
+        self.encoding = encoding
+        self.only_if_changed = only_if_changed
+        self.changed = False
+        self.tmpname = None
+        self.file = None
+
+    def __enter__(self):
+        dirname = os.path.dirname(os.path.abspath(self.filename))
+        fd, self.tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + os.path.basename(self.filename),
+                                            suffix='.tmp')
+        if 'b' in self.mode:
+            self.file = os.fdopen(fd, self.mode)
+        else:
+            self.file = os.fdopen(fd, self.mode, encoding=self.encoding)
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        if exc_type is not None:
+            os.remove(self.tmpname)
+            return False
+        if self.only_if_changed and os.path.exists(self.filename) and \
+                filecmp.cmp(self.tmpname, self.filename, shallow=False):
+            os.remove(self.tmpname)
+            self.changed = False
+            return False
+        # mkstemp makes files only readable by the owner
+        if os.path.exists(self.filename):
+            mode = os.stat(self.filename).st_mode & 0o7777
+        else:
+            mode = 0o666 & ~_UMASK
+        os.chmod(self.tmpname, mode)
+        os.replace(self.tmpname, self.filename)
+        self.changed = True
+        return False
+
+
+class _StreamReader(object):
+    '''Read a decompressed file from start to end.
+
+    The decompressing file objects can seek, but only by decompressing
+    everything up to that point again, so this one claims that it cannot,
+    and ``NotebookReader`` does not try.
+    '''
+    def __init__(self, f, raw):
+        self.f = f
+        self.raw = raw
+        self.name = getattr(raw, 'name', None)
+
+    def read(self, n=-1):
+        return self.f.read(n)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    def close(self):
+        self.f.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _needs_zstd():
+    if (zstd is None) and (zstandard is None):
+        raise ImportError('zstd compressed notebooks need the zstandard package (or Python 3.14).')
+
+
+def compression_of(f):
+    '''Return the compression of an open binary file (``'gzip'``, ``'xz'``, ...) or ``None``.
+
+    Only the first bytes are looked at and the position in the file is not changed.
+    '''
+    if hasattr(f, 'peek'):
+        start = f.peek(6)[:6]
+    elif f.seekable():
+        pos = f.tell()
+        start = f.read(6)
+        f.seek(pos)
+    else:
+        return None
+    for magic, compression in _MAGIC:
+        if start.startswith(magic):
+            return compression
+    return None
+
+
+def decompressing(f):
+    '''Return a file object that reads the decompressed content of ``f``.
+
+    If ``f`` is not compressed, it is returned as it is.
+    '''
+    compression = compression_of(f)
+    if compression is None:
+        return f
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=f, mode='rb')
+    elif compression == 'xz':
+        stream = lzma.LZMAFile(f, 'rb')
+    elif compression == 'bz2':
+        stream = bz2.BZ2File(f, 'rb')
+    else:
+        _needs_zstd()
+        if zstd is not None:
+            stream = zstd.ZstdFile(f, 'rb')
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True,
+                                                                closefd=False)
+    return _StreamReader(stream, f)
+
+
+def open_notebook(filename):
+    '''Open a notebook (``'-'`` for stdin) for reading, decompressing it if necessary.'''
+    if filename == '-':
+        return decompressing(sys.stdin.buffer)
+    return decompressing(open(filename, 'rb'))
+
+
+def compressing(f, filename):
+    '''Return a file object that writes to ``f``, compressed according to the extension of ``filename``.
+
+    Closing it does not close ``f``. Without a known extension, ``f`` itself
+    is returned.
+    '''
+    compression = _EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if compression is None:
+        return f
+    if compression == 'gzip':
+        # No time stamp, so that the same content gives the same file.
+        return gzip.GzipFile(filename='', fileobj=f, mode='wb', mtime=0)
+    if compression == 'xz':
+        return lzma.LZMAFile(f, 'wb')
+    if compression == 'bz2':
+        return bz2.BZ2File(f, 'wb')
+    _needs_zstd()
+    if zstd is not None:
+        return zstd.ZstdFile(f, 'wb')
+    return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+
+
+def splice(infile, outfile, patches, chunksize=2**20):
+    '''Copy ``infile`` to ``outfile``, replacing some byte ranges.
+
+    ``infile`` and ``outfile`` can be the same file. The rest of the file is
+    copied in chunks without looking at it, and ``outfile`` is replaced
+    atomically (see ``AtomicWriter``).
+    A compressed ``infile`` is decompressed first (the byte ranges are
+    positions in the decompressed content) and ``outfile`` is compressed
+    if its name ends in ``.gz``, ``.xz``, ``.bz2`` or ``.zst``.
+
+    Parameters
+    ----------
+    infile, outfile : string
+        Filenames
+    patches : list
+        ``(start, end, data)``: the bytes from ``start`` to ``end`` in
+        ``infile`` are replaced by the bytes ``data``. Ranges must not overlap.
+    chunksize : int
+        Copy in chunks of this many bytes.
+
+    Returns
+    -------
+    changed : bool
+        ``False`` if ``outfile`` already had this content and was left alone.
+    '''
+    writer = AtomicWriter(outfile, mode='wb')
+    with open_notebook(infile) as fin, writer as rawout:
+        fout = compressing(rawout, outfile)
+        pos = 0
+        for start, end, data in sorted(patches, key=lambda patch: patch[0]):
+            _copy(fin, fout, start - pos, chunksize)
+            fout.write(data)
+            if fin.seekable():
+                fin.seek(end)
+            else:
+                _copy(fin, None, end - start, chunksize)
+            pos = end
+        _copy(fin, fout, None, chunksize)
+        if fout is not rawout:
+            fout.close()
+    return writer.changed
+
+
+def _copy(fin, fout, n, chunksize):
+    '''Copy ``n`` bytes (everything if ``None``) from ``fin`` to ``fout`` (or skip them if ``None``).'''
+    while (n is None) or (n > 0):
+        data = fin.read(chunksize if n is None else min(n, chunksize))
+        if not data:
+            return
+        if fout is not None:
+            fout.write(data)
+        if n is not None:
+            n -= len(data)
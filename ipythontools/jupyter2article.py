@@ -30,17 +30,40 @@ Installing this module places a script in your path, so you can do:
 
 In this case it's run with my set of design choices (see below).
 
+Use ``-`` instead of a filename to read the notebook from stdin or write
+the LaTeX to stdout. Compressed notebooks (gzip, xz, bz2 or zstd) are
+read directly, without unpacking them first.
+To split a notebook into several files (e.g. the paper and the appendix),
+add ``--range START STOP OUTFILE`` as often as needed. The notebook is
+only read once.
+For long notebooks, add ``--cache myanalysis.cache`` to keep the converted
+LaTeX for every cell in a file. The next time only cells that changed
+are converted again. With ``--watch`` the script keeps running and converts
+the notebook again every time it is saved. The LaTeX file is only replaced
+when its content actually changes. ``--profile`` shows where the time goes.
+If ``ipythontools-server`` is running, ``--server`` lets it do the
+conversion, which saves starting python and filling the cache every time.
+``--also text myanalysis.txt`` (or ``markdown``) writes the same cells in
+another format in the same run, e.g. for a grammar checker.
+With ``--spill_size 20`` the output of code cells that is longer than 20 kB
+(e.g. a huge table) goes into a file of its own and the LaTeX file gets an
+``\input`` for it.
+Duplicate labels and references to labels that do not exist are reported
+with the numbers of the cells they are in (see ``crossref``); add
+``--bib refs.bib`` to check citations, too.
+
 As a Python module
 ------------------
 Import into python and make a ``NotebookConverter`` object::
 
-    from ipynb2article import NotebookConverter
-    converter = NotebookConverter
+    from ipythontools.jupyter2article import NotebookConverter, IgnoreConverter
+    converter = NotebookConverter()
 
 Then, customize how each type of cell is converted by changing the converter::
 
-    converter.cellconverters['code'] = NotebookConverter.IgnoreConverter()
+    converter.cellconverters['code'] = IgnoreConverter()
 
+(This only changes this one ``converter``.)
 Finally, call::
 
     converter.convert(infile, outfile, ...)
@@ -54,6 +77,14 @@ However, I do not use this option any longer, because that means I would have
 multiple input files. If I put all those LaTeX headers into the notebook as
 well, I only have a single file.
 
+``convert_to_string`` and ``convert_stream`` work like ``convert``, but return a
+string or write into an open file; ``convert_ranges`` writes several parts
+of the notebook into separate files. To convert many notebooks in parallel,
+call::
+
+    converter.convert_many([{'infile': 'paper1.ipynb', 'outfile': 'paper1.tex'},
+                            {'infile': 'paper2.ipynb', 'outfile': 'paper2.tex'}])
+
 Design
 ======
 
@@ -94,27 +125,159 @@ a line break at the end of the  cell) and puts it into the LaTeX file
 it and if so, it copies the output of this cell, and ``LatexHeadingConverter``
 looks for the level of the heading and turns that into LaTeX (it also adds
 as label like "\label{sect:title}").
+The converters do not return LaTeX directly, but a few document nodes
+(headings, paragraphs, LaTeX blocks, code output; see ``document``). An
+emitter turns those into LaTeX, plain text or Markdown, so the notebook
+is converted once, no matter how many formats are written. A converter
+that returns a LaTeX string still works, that is just a LaTeX block.
 '''
-import json
+import io
+import os
 import re
 import sys
+import time
 import argparse
+import contextlib
+from collections import namedtuple
+from concurrent import futures
+
+from .nbreader import NotebookReader, as_cell
+from .cache import ConversionCache
+from .profiling import ConversionProfile
+from .crossref import CrossrefIndex, read_bibkeys
+from .document import (Heading, Paragraph, LatexBlock, CodeOutput, BlankLines, LatexEmitter,
+                       EMITTERS, as_nodes, dump_nodes, load_nodes, get_emitter)
+from .fileutils import AtomicWriter
+from . import watch
+from . import client
 
 
 def ismarkercell(cell, start):
     '''Compare the first line of cell content with string "start".'''
-    if 'source' in cell.keys():
-        # Marker cell will often be markdown cells starting with `#` characters
-        # because they are headings.
-        # Strip thosecharacters and compare the text in the first line only.
-        if ('cell_type' in cell.keys()) and (cell['cell_type'] == 'markdown'):
-            return cell['source'][0].lstrip('# ') == start.lstrip('# ')
+    cell = as_cell(cell)
+    if len(cell.source) == 0:
+        return False
+    # Marker cell will often be markdown cells starting with `#` characters
+    # because they are headings.
+    # Strip thosecharacters and compare the text in the first line only.
+    if cell.cell_type == 'markdown':
+        return cell.source[0].lstrip('# ') == start.lstrip('# ')
+    return cell.source[0] == start
+
+
+_HEADER = re.compile(r'\s*#+\s*')
+
+
+def sectionlabel(title):
+    '''Make the label for a section title, e.g. "sect:introduction".'''
+    return 'sect:' + re.sub(r'\W+', '', title).lower()
+
+
+class CellIndex(object):
+    '''Find cells by their first line, by heading title or by section label.
+
+    The index is filled one cell at a time with ``add`` while the notebook is
+    read, so the markers for any number of cell ranges can be found in a
+    single pass through the notebook.
+    The following keys point to the first cell they appear in:
+
+    - the first line of the cell (compared in the same way as in
+      ``ismarkercell``, i.e. leading ``#`` and spaces are ignored for markdown
+      cells),
+    - the title of each heading in the cell,
+    - the label that is generated for each heading (``sect:title``).
+    '''
+    def __init__(self):
+        self.firstlines = {}
+        self.markdownlines = {}
+        self.titles = {}
+
+    def add(self, i, cell):
+        '''Add cell number ``i`` (a ``Cell``) to the index.'''
+        source = cell.source
+        celltype = cell.cell_type
+        if len(source) > 0:
+            if celltype == 'markdown':
+                self.markdownlines.setdefault(source[0].lstrip('# '), i)
+            else:
+                self.firstlines.setdefault(source[0], i)
+        titles = []
+        if celltype == 'heading':
+            titles.append(''.join(source))
+        elif celltype == 'markdown':
+            for line in source:
+                match = _HEADER.match(line)
+                if match:
+                    titles.append(line[match.end():].rstrip('\n'))
+        for title in titles:
+            self.titles.setdefault(title, i)
+            self.titles.setdefault(sectionlabel(title), i)
+
+    def find(self, marker):
+        '''Return number of the first cell that matches ``marker`` or ``None``.'''
+        found = [self.firstlines.get(marker),
+                 self.markdownlines.get(marker.lstrip('# ')),
+                 self.titles.get(marker)]
+        found = [i for i in found if i is not None]
+        return min(found) if found else None
+
+
+class _CellRange(object):
+    '''Decide which cells are between ``start`` and ``stop``, one cell at a time.
+
+    See ``NotebookConverter.convert`` for the meaning of ``start`` and ``stop``.
+    '''
+    def __init__(self, start, stop, find_cell):
+        if not isinstance(start, str):
+            start = find_cell(None, start)
+        if not isinstance(stop, str):
+            stop = find_cell(None, stop)
+            if not isinstance(start, str) and start > stop:
+                raise Exception('Start cell found after end cell')
+        self.start = start
+        self.stop = stop
+        self.first = None if isinstance(start, str) else start
+        self.stopfound = False
+        self.done = False
+        self.ncells = 0
+
+    def includes(self, i, index):
+        '''Check if cell ``i`` (which has to be in ``index`` already) is in the range.'''
+        self.ncells = i + 1
+        if self.done:
+            return False
+        if self.stopfound:
+            # only keep looking for start to report the right error
+            if index.find(self.start) == i:
+                raise Exception('Start cell found after end cell')
+            return False
+        if (self.first is None) and (index.find(self.start) == i):
+            self.first = i + 1
+            if not isinstance(self.stop, str) and self.first > self.stop:
+                raise Exception('Start cell found after end cell')
+        if isinstance(self.stop, str):
+            isstop = index.find(self.stop) == i
         else:
-            return cell['source'][0] == start
-    elif 'input' in cell.keys():
-        return cell['input'][0] == start
-    else:
-        raise ValueError('Type of cell not recognized.')
+            isstop = i >= self.stop
+        if isstop:
+            if self.first is None:
+                self.stopfound = True
+            elif self.first > i:
+                raise Exception('Start cell found after end cell')
+            else:
+                self.done = True
+            return False
+        return (self.first is not None) and (i >= self.first)
+
+    def finish(self):
+        '''Raise an error if ``start`` or ``stop`` were not found.'''
+        if self.first is None:
+            raise ValueError('cell "{0}" not found in notebook.'.format(self.start))
+        if not isinstance(self.start, str) and not self.done and self.start > self.ncells:
+            # The notebook ended before the (numbered) stop cell.
+            raise Exception('Start cell found after end cell')
+        if isinstance(self.stop, str) and not self.done:
+            raise ValueError('cell "{0}" not found in notebook.'.format(self.stop))
 
 
 class IgnoreConverter(object):
@@ -122,21 +285,41 @@ class IgnoreConverter(object):
     def __call__(self, cell):
         return []
 
+    def needs_outputs(self, cell):
+        return False
+
 
 class LiteralSourceConverter(object):
     '''This converter return the literal ``source`` entry of a cell.'''
     def __call__(self, cell):
-        text = cell['source']
+        text = cell.source
 
         if len(text) > 0:
-            text[-1] +='\n'
+            return [LatexBlock(text), BlankLines(1)]
         else:
-            return '\n'
-        return text
+            return [BlankLines(1)]
 
 
 class MarkedCodeOutputConverter(object):
-    '''Add output of code cells that have a specific string in the code cell'''
+    '''Add output of code cells that have a specific string in the code cell
+
+    These outputs are used:
+
+    - text printed to stdout or stderr,
+    - the value of the last line of the cell (``execute_result``), as
+      ``text/latex`` if it has that representation (e.g. an astropy table,
+      so that it does not have to be printed), and as ``text/plain``
+      otherwise,
+    - ``text/latex`` in displayed data, e.g. from ``display(Latex(...))``.
+      Plain text of displayed data is usually just a placeholder for a plot,
+      so it is left out.
+
+    Each output becomes one ``CodeOutput`` node. Notebooks store LaTeX and
+    plain text without a final line break, so one is added where it is
+    missing; otherwise a table and the next output would end up on the same
+    line. The output of a cell is held in memory as a whole, so one huge
+    table still needs as much memory as before.
+    '''
     def __init__(self, marker):
         '''Add output of code cells that have a specific string in the code cell
 
@@ -150,22 +333,43 @@ class MarkedCodeOutputConverter(object):
         '''
         self.marker = marker
 
-    def __call__(self, cell):
-        text = []
-        if 'source' in cell:
-            # Newer version of notebook
-            source = cell['source']
-        else:
-            # Older version of Notebook
-            source = cell['input']
-        if (self.marker in source) or (self.marker + '\n' in source):
-            for out in cell['outputs']:
-                if 'text' in out:
-                    text.extend(out['text'])
+    def needs_outputs(self, cell):
+        '''Check if the code in ``cell`` matches ``marker``.
 
-        if len(text) > 0:
-            text[-1] += '\n'
-        return text
+        Outputs of cells that do not match are not needed, so the notebook
+        reader does not need to decode them.
+        '''
+        source = cell.source
+        return (self.marker in source) or (self.marker + '\n' in source)
+
+    def output_text(self, out):
+        '''Return the text of one output that goes into the LaTeX file, or ``None``.'''
+        outputtype = out.get('output_type')
+        if outputtype == 'stream':
+            return out.get('text')
+        # Old notebooks keep the representations in the output itself
+        data = out.get('data', out)
+        latex = data.get('text/latex', out.get('latex'))
+        if latex is not None:
+            return latex
+        if outputtype in ('execute_result', 'pyout'):
+            return data.get('text/plain', out.get('text'))
+        return None
+
+    def __call__(self, cell):
+        if not self.needs_outputs(cell):
+            return []
+        nodes = []
+        for out in cell.outputs:
+            text = self.output_text(out)
+            if text:
+                lines = [text] if isinstance(text, str) else list(text)
+                if (out.get('output_type') != 'stream') and not lines[-1].endswith('\n'):
+                    lines.append('\n')
+                nodes.append(CodeOutput(lines))
+        if nodes:
+            nodes.append(BlankLines(1))
+        return nodes
 
 
 class LatexHeadingConverter(object):
@@ -177,16 +381,14 @@ class LatexHeadingConverter(object):
         Latex equivalents for 'Heading 1', 'Heading 2' etc.
     '''
     def __init__(self, latexlevels=['chapter', 'section', 'subsection', 'subsubsection', 'paragraph', 'subparagraph']):
-        self.latexlevels = latexlevels
+        self.latexlevels = list(latexlevels)
 
     def __call__(self, cell):
         # Just to be careful for multi-line headings
-        title = ''.join(cell['source'])
-        line1 = '\\{0}{{{1}}}\n'.format(self.latexlevels[cell['level'] - 1],
-                                      title)
-        cleantitle = re.sub(r'\W+', '', title)
-        line2 = '\\label{{sect:{0}}}\n'.format(cleantitle.lower())
-        return ['\n', '\n', line1, line2, '\n']
+        title = ''.join(cell.source)
+        return [BlankLines(2),
+                Heading(cell.level, title, sectionlabel(title), self.latexlevels[cell.level - 1]),
+                BlankLines(1)]
 
 
 class MinimalMarkdownConverter(object):
@@ -209,52 +411,102 @@ class MinimalMarkdownConverter(object):
         Latex equivalents for 'Heading 1', 'Heading 2' etc.
     '''
     def __init__(self, latexlevels=['chapter', 'section', 'subsection', 'subsubsection', 'paragraph', 'subparagraph']):
-        self.latexlevels = latexlevels
+        self.latexlevels = list(latexlevels)
 
     def __call__(self, cell):
-        text = cell['source']
+        text = cell.source
         if len(text) == 0:
             # empty cell - make new paragraph in text
-            return '\n'
+            return [BlankLines(1)]
 
-        header = re.compile('\s*#+\s*')
         out = []
+        paragraph = []
         for line in text:
-            match = header.match(line)
+            match = _HEADER.match(line)
             if match:
                 title = line[match.end():]
                 # This happens if title is part of a cell with more lines.
                 # Could probably be done in regular expression, but I prefer being
                 # explicit here to avoid problems with obscure LaTeX constructs within
                 # the title.
-                if title[-1] == '\n':
+                if title.endswith('\n'):
                     title = title[:-1]
                 level = line[:match.end()].count('#')
-                line1 = '\\{0}{{{1}}}\n'.format(self.latexlevels[level - 1], title)
-                cleantitle = re.sub(r'\W+', '', title)
-                line2 = '\\label{{sect:{0}}}\n'.format(cleantitle.lower())
-                out.extend([line1, line2])
+                if paragraph:
+                    out.append(Paragraph(paragraph))
+                    paragraph = []
+                out.append(Heading(level, title, sectionlabel(title), self.latexlevels[level - 1]))
             else:
-                out.append(line)
+                paragraph.append(line)
+        if paragraph:
+            out.append(Paragraph(paragraph))
 
         # end with an empty line to start a new paragraph in LaTeX
-        out.extend(['\n', '\n'])
+        out.append(BlankLines(2))
         return out
 
 
+def default_cellconverters():
+    '''Return a new dictionary with my choice of converters for each cell type.'''
+    return {
+            'code' : MarkedCodeOutputConverter('# output->LaTeX'),
+            'heading': LatexHeadingConverter(),
+            'markdown': MinimalMarkdownConverter(),
+            'raw': LiteralSourceConverter()
+            }
+
+
+ConversionResult = namedtuple('ConversionResult', ['job', 'changed', 'error'])
+'''Result of one job in ``NotebookConverter.convert_many``.'''
+
+# Converter used by each worker process in NotebookConverter.convert_many
+_worker_converter = None
+
+
+def _init_worker(converter):
+    global _worker_converter
+    _worker_converter = converter
+
+
+def _convert_job(job):
+    return _worker_converter.run_job(job)
+
+
 class NotebookConverter(object):
-    cellconverters = {
-                      'code' : MarkedCodeOutputConverter('# output->LaTeX'),
-                      'heading': LatexHeadingConverter(),
-                      'markdown': MinimalMarkdownConverter(),
-                      'raw': LiteralSourceConverter()
-                      }
+    '''Convert notebooks to LaTeX.
+
+    Parameters
+    ----------
+    cellconverters : dict or None
+        Converters for each cell type. Entries in this dictionary replace
+        the default converters (see ``default_cellconverters``).
+        Each ``NotebookConverter`` has its own dictionary in the attribute
+        ``cellconverters``, so changing it does not affect other converters.
+    cache : ``ConversionCache`` or None
+        Reuse the LaTeX of cells that were converted before.
+    profile : ``ConversionProfile`` or None
+        Record where the time of each conversion goes.
+    spill_size : int or None
+        Code output longer than this many characters is written to a file
+        of its own next to the LaTeX file and included with ``\\input``
+        (see ``document.LatexEmitter``).
+    '''
+    def __init__(self, cellconverters=None, cache=None, profile=None, spill_size=None):
+        self.cellconverters = default_cellconverters()
+        if cellconverters is not None:
+            self.cellconverters.update(cellconverters)
+        self.cache = cache
+        self.profile = profile
+        self.spill_size = spill_size
+        self._templates = {}
 
     def find_cell(self, cells, marker, skip=0):
         '''return number of cell that's specified either by number of by content'''
         if isinstance(marker, str):
+            index = CellIndex()
             for i, c in enumerate(cells):
-                if ismarkercell(cells[i], marker):
+                index.add(i, as_cell(c))
+                if index.find(marker) == i:
                     return i + skip
             raise ValueError('cell "{0}" not found in notebook.'.format(marker))
         else:
@@ -263,15 +515,45 @@ class NotebookConverter(object):
             except:
                 raise ValueError('Cells need to be specified with integer number or content string')
 
+    def needs_outputs(self, cell):
+        '''Check if the converter for this cell uses the outputs of the cell.
+
+        Converters can define a ``needs_outputs(cell)`` method; converters
+        without it are assumed to need the outputs.
+        '''
+        converter = self.cellconverters.get(cell.cell_type)
+        needs_outputs = getattr(converter, 'needs_outputs', None)
+        return (needs_outputs is None) or needs_outputs(cell)
+
+    def cell_nodes(self, cell):
+        '''Convert a single cell into document nodes (see ``document``).
+
+        ``cell`` can be a ``nbreader.Cell`` or a cell dictionary as in the
+        notebook file. Cell converters are always called with a ``Cell``.
+        '''
+        cell = as_cell(cell)
+        converter = self.cellconverters[cell.cell_type]
+        if self.cache is None:
+            return as_nodes(converter(cell))
+        # Calculate key first, because converters might change the cell
+        key = self.cache.key(cell, converter)
+        stored = self.cache.get(key)
+        if stored is None:
+            nodes = as_nodes(converter(cell))
+            self.cache.set(key, dump_nodes(nodes))
+            return nodes
+        return load_nodes(stored)
+
     def convert(self, infile, outfile, start=0, stop=100000000, file_before=None, file_after=None):
         '''Convert IPython notebook to LaTeX file.
 
         Parameters
         ----------
         infile : string
-            filename of IPython notebook
+            filename of IPython notebook (``'-'`` for stdin)
         outfile : string
-            filename of Latex file to be written
+            filename of Latex file to be written (``'-'`` for stdout).
+            The file is written in UTF-8 encoding.
         start : int or string
             If this is a number, skip that many cells starting from the top;
             if it is a string, skip cells until a cell has *exactly* the
@@ -282,56 +564,315 @@ class NotebookConverter(object):
             ``[5]`` in the ipython notebook)
             if it is a string, skip cells after the cell that has *exactly* the
             content that ``stop`` has.
+            Strings can also match the title of a heading or the label that
+            is generated for it (e.g. ``"sect:introduction"``).
         file_before : string
         file_after: string
             String with filename. These files are copied above and below
             the content from the ipynb file. Use this e.g. for templates
             that contain the LaTeX header info that does not appear in the
             notebook.
+
+        Returns
+        -------
+        changed : bool
+            ``outfile`` is only replaced if its content changes (and never
+            left half-written if the conversion fails). This is ``True`` if it
+            was replaced.
+        '''
+        return self.convert_ranges(infile, [(start, stop, outfile)], file_before, file_after)[0]
+
+    def convert_ranges(self, infile, ranges, file_before=None, file_after=None, log=None,
+                       bibfiles=None, crossref=None, spill_size=None, warn=True):
+        '''Convert several parts of a notebook into separate LaTeX files.
+
+        The notebook is read only once, no matter how many parts are written,
+        e.g. to split it into the paper, the appendix and supplementary
+        material.
+
+        Parameters
+        ----------
+        infile : string
+            filename of IPython notebook (``'-'`` for stdin)
+        ranges : list of tuples
+            Each tuple is ``(start, stop, outfile)``. See ``convert``
+            for the meaning of these values. A fourth element can name
+            the output format (``'latex'``, ``'text'``, ``'markdown'``, see
+            ``document.EMITTERS``) or give an ``Emitter``. All formats
+            are written from a single pass through the notebook.
+        file_before : string
+        file_after: string
+            These files are copied above and below every LaTeX part.
+        log : file object or None
+            Progress messages are printed here. The default is stdout
+            (or stderr, if any part is written to stdout).
+            This includes warnings about duplicate labels and references
+            to undefined labels (see ``crossref``). Labels in all parts and
+            in the templates count.
+        bibfiles : list of strings or None
+            Also warn about citations that are not in these ``.bib`` files.
+        crossref : string or None
+            Write all labels, references, citations and problems with them
+            to this JSON file.
+        spill_size : int or None
+            Overrides the ``spill_size`` of the converter for this call.
+        warn : bool
+            Set to ``False`` to not print warnings about labels and
+            references, e.g. because they are checked together with other
+            notebooks (see ``crossref.CrossrefIndex.combine``).
+
+        Returns
+        -------
+        changed : list of bool
+            ``True`` for every ``outfile`` that was replaced.
+            If any range cannot be found, no file is written.
+        '''
+        t0 = time.perf_counter()
+        ranges = list(ranges)
+        if log is None:
+            # Progress messages must not end up in the LaTeX
+            log = sys.stderr if '-' in [r[2] for r in ranges] else sys.stdout
+        print('Parsing ', infile, file=log)
+        if spill_size is None:
+            spill_size = self.spill_size
+        emitters = [self._emitter(r, spill_size) for r in ranges]
+        index = CrossrefIndex(infile)
+        # Each part goes straight into a temporary file, which only replaces
+        # the old file if the whole conversion works.
+        writers = [None if r[2] == '-' else AtomicWriter(r[2], encoding='utf-8') for r in ranges]
+        with contextlib.ExitStack() as stack:
+            outs = [io.StringIO() if writer is None else stack.enter_context(writer)
+                    for writer in writers]
+            # Spilled output is written (or discarded) just before the parts
+            for emitter in dict((id(e), e) for e in emitters).values():
+                if isinstance(emitter, LatexEmitter) and (emitter.spill_size is not None):
+                    stack.push(emitter.finish)
+            if infile == '-':
+                self._convert_into(sys.stdin.buffer, [r[:2] for r in ranges], outs,
+                                   file_before, file_after, name=infile, emitters=emitters,
+                                   crossref=index)
+            else:
+                with open(infile, 'rb') as f:
+                    self._convert_into(f, [r[:2] for r in ranges], outs, file_before, file_after,
+                                       name=infile, emitters=emitters, crossref=index)
+            t1 = time.perf_counter()
+        bibkeys = None if not bibfiles else read_bibkeys(bibfiles)
+        if warn:
+            for message in index.messages(bibkeys):
+                print(message, file=log)
+        if crossref is not None:
+            index.write(crossref, bibkeys)
+        changed = []
+        for r, writer, out in zip(ranges, writers, outs):
+            if writer is None:
+                self._write_stdout(out.getvalue())
+                changed.append(True)
+            else:
+                print('Writing ' if writer.changed else 'No changes in ', r[2], file=log)
+                changed.append(writer.changed)
+        if self.profile is not None:
+            t2 = time.perf_counter()
+            self.profile.add_time('write', t2 - t1)
+            self.profile.add_total(t2 - t0)
+        return changed
+
+    def _emitter(self, r, spill_size):
+        '''Return the emitter for the range ``r`` of ``convert_ranges``.'''
+        emitter = get_emitter(r[3] if len(r) > 3 else None)
+        if (spill_size is not None) and (type(emitter) is LatexEmitter) and \
+                (emitter.spill_size is None) and (r[2] != '-'):
+            # Spilled outputs go next to the LaTeX file: paper-output-<hash>.tex
+            emitter = LatexEmitter(spill_size, os.path.splitext(r[2])[0] + '-output')
+        return emitter
+
+    def _write_stdout(self, text):
+        sys.stdout.flush()
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        out.write(text)
+        out.flush()
+        out.detach()
+
+    def convert_stream(self, fp_in, fp_out, start=0, stop=100000000, file_before=None, file_after=None):
+        '''Convert IPython notebook from an open file to LaTeX.
+
+        Parameters
+        ----------
+        fp_in : file object
+            Notebook, preferably opened in binary mode.
+        fp_out : file object
+            LaTeX is written to this file (opened in text mode).
+            Nothing is written if the conversion fails.
+
+        See ``convert`` for the remaining parameters.
+        '''
+        out = io.StringIO()
+        self._convert_into(fp_in, [(start, stop)], [out], file_before, file_after)
+        fp_out.write(out.getvalue())
+
+    def convert_to_string(self, infile, start=0, stop=100000000, file_before=None, file_after=None):
+        '''Convert IPython notebook to LaTeX and return it as a string.
+
+        See ``convert`` for the parameters.
         '''
-        with open(infile, 'r') as f:
-            print('Parsing ', infile)
-            ipynb = json.load(f)
+        out = io.StringIO()
+        with open(infile, 'rb') as f:
+            self._convert_into(f, [(start, stop)], [out], file_before, file_after, name=infile)
+        return out.getvalue()
+
+    def read_template(self, filename):
+        '''Return the content of ``file_before`` or ``file_after``.
 
-        if 'cells' in ipynb:
-            # newer versions of notebook
-            cells = ipynb['cells']
+        Each file is only read again if it changed since the last call.
+        '''
+        st = os.stat(filename)
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._templates.get(filename)
+        if (cached is None) or (cached[0] != stamp):
+            with open(filename, 'r', encoding='utf-8') as f:
+                cached = (stamp, f.read())
+            self._templates[filename] = cached
+        return cached[1]
+
+    def _convert_into(self, fp_in, ranges, outs, file_before, file_after, name='<stream>',
+                      emitters=None, crossref=None):
+        '''Convert cells and write the text of each range into the file in ``outs``.
+
+        Each cell is written as soon as it is converted, so the whole
+        document never has to be in memory. ``outs`` should discard what was
+        written if this raises an exception (e.g. ``AtomicWriter``).
+        '''
+        if isinstance(fp_in, io.TextIOBase):
+            buffer = getattr(fp_in, 'buffer', None)
+            fp_in = buffer if buffer is not None else io.BytesIO(fp_in.read().encode('utf-8'))
+        profile = self.profile
+        if emitters is None:
+            emitters = [get_emitter(None)] * len(ranges)
+        if crossref is None:
+            # Still needed to keep the labels of headings apart
+            crossref = CrossrefIndex(name)
+
+        if profile is not None:
+            t0 = time.perf_counter()
+        before = '' if file_before is None else self.read_template(file_before)
+        after = '' if file_after is None else self.read_template(file_after)
+        if profile is not None:
+            profile.add_time('templates', time.perf_counter() - t0)
+            t0 = time.perf_counter()
+        # Templates hold LaTeX headers, which make no sense in other formats
+        islatex = [isinstance(emitter, LatexEmitter) for emitter in emitters]
+        if any(islatex):
+            for filename, text in [(file_before, before), (file_after, after)]:
+                if filename is not None:
+                    crossref.add_template(filename, text)
+        for out, latex in zip(outs, islatex):
+            if latex:
+                out.write(before)
+        if profile is not None:
+            profile.add_time('write', time.perf_counter() - t0)
+
+        cells = NotebookReader(fp_in, needs_outputs=self.needs_outputs)
+        if profile is not None:
+            cells = profile.read(cells)
+        index = CellIndex()
+        cellranges = [_CellRange(start, stop, self.find_cell) for start, stop in ranges]
+        for i, cell in enumerate(cells):
+            if profile is not None:
+                t0 = time.perf_counter()
+            index.add(i, cell)
+            included = [cellrange.includes(i, index) for cellrange in cellranges]
+            if profile is not None:
+                profile.add_time('index', time.perf_counter() - t0)
+            if any(included):
+                if profile is not None:
+                    profile.read_outputs(cell)
+                    t0 = time.perf_counter()
+                # Convert each cell only once, even if it is in several ranges or formats
+                nodes = crossref.add(i, self.cell_nodes(cell))
+                texts = {}
+                for isincluded, emitter in zip(included, emitters):
+                    if isincluded and (id(emitter) not in texts):
+                        texts[id(emitter)] = emitter.emit(nodes)
+                if profile is not None:
+                    t1 = time.perf_counter()
+                    # Count the text of one format only, LaTeX if the cell is in a LaTeX part
+                    parts = [j for j, isincluded in enumerate(included) if isincluded]
+                    primary = next((j for j in parts if islatex[j]), parts[0])
+                    profile.add_cell(name, i, cell, self.cellconverters[cell.cell_type],
+                                     t1 - t0, texts[id(emitters[primary])])
+                for isincluded, emitter, out in zip(included, emitters, outs):
+                    if isincluded:
+                        out.write(texts[id(emitter)])
+                if profile is not None:
+                    profile.add_time('write', time.perf_counter() - t1)
+            if all(r.done for r in cellranges):
+                # No need to read the rest of the notebook
+                break
+        for cellrange in cellranges:
+            cellrange.finish()
+        if profile is not None:
+            t0 = time.perf_counter()
+        for out, latex in zip(outs, islatex):
+            if latex:
+                out.write(after)
+        if profile is not None:
+            profile.add_time('write', time.perf_counter() - t0)
+
+    def run_job(self, job):
+        '''Call ``convert_ranges`` if ``job`` (a dict of keyword arguments) has ``ranges``, else ``convert``.'''
+        if 'ranges' in job:
+            return self.convert_ranges(**job)
+        return self.convert(**job)
+
+    def convert_many(self, jobs, workers=None, backend='process'):
+        '''Convert several notebooks concurrently.
+
+        Parameters
+        ----------
+        jobs : list of dicts
+            Each dict holds the keyword arguments for one call of ``convert``,
+            e.g. ``{'infile': 'paper.ipynb', 'outfile': 'paper.tex'}``, or
+            of ``convert_ranges`` if it has ``ranges``, see ``run_job``.
+        workers : int or None
+            Number of threads or processes. ``None`` uses one per CPU core.
+        backend : 'process' or 'thread'
+            Converting is CPU bound, so processes are faster.
+            However, each worker process works on a copy of this converter,
+            so the cell converters have to be picklable and cells that are
+            added to the cache (or times added to the ``profile``) are not
+            seen by other jobs.
+
+        Returns
+        -------
+        results : list of ``ConversionResult``
+            One per job in the same order as ``jobs``. ``changed`` is the return
+            value of ``convert`` (or ``convert_ranges``); if the job failed,
+            ``error`` holds the exception.
+        '''
+        jobs = list(jobs)
+        if backend == 'thread':
+            executor = futures.ThreadPoolExecutor(max_workers=workers)
+            submit = lambda job: executor.submit(self.run_job, job)
+        elif backend == 'process':
+            executor = futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                   initargs=(self,))
+            submit = lambda job: executor.submit(_convert_job, job)
         else:
-            # notebook format 1
-            cells = ipynb['worksheets'][0]['cells']
-        start = self.find_cell(cells, start, skip=1)
-        stop = self.find_cell(cells, stop)
-        if stop > len(cells):
-            stop = len(cells)
-        if start > stop:
-            raise Exception('Start cell found after end cell')
-        cells = cells[start:stop]
-
-        with open(outfile, 'w') as out:
-            print('Writing ', outfile)
-            if file_before is not None:
-                with open(file_before, 'r') as f:
-                    for line in f:
-                        try:
-                            out.write(line)
-                        except UnicodeEncodeError:
-                            raise ValueError(line)
-
-            for cell in cells:
-                lines = self.cellconverters[cell['cell_type']](cell)
-                for line_num, line in enumerate(lines):
-                    try:
-                        out.write(line)
-                    except UnicodeEncodeError:
-                        raise ValueError(line)
-
-            if file_after is not None:
-                with open(file_after, 'r') as f:
-                    for line in f:
-                        try:
-                            out.write(line)
-                        except UnicodeEncodeError:
-                            raise ValueError(line)
+            raise ValueError('backend must be "process" or "thread".')
+
+        results = []
+        with executor:
+            running = [submit(job) for job in jobs]
+            for job, future in zip(jobs, running):
+                try:
+                    results.append(ConversionResult(job, future.result(), None))
+                except Exception as e:
+                    results.append(ConversionResult(job, None, e))
+        return results
+
+
+def _cellarg(value):
+    '''Cells on the command line are numbers if they are all digits, else content.'''
+    return int(value) if value.isdigit() else value
 
 
 def jupyter2article():
@@ -341,13 +882,13 @@ def jupyter2article():
 Raw cells and markdown cells are copied verbatim. Code cells are ignored, unless they contain the string `# output->LaTeX`. In this case their output is copied verbatim; this is useful to generate some LaTeX automatically, e.g. a table.
 Additionally, headings are converted to LaTeX chapter, section, subsection etc. .
 ''')
-    parser.add_argument('infile', help='path and filename of the input notebook file.')
-    parser.add_argument('outfile', help='path and filename of the output LaTeX file.')
-    parser.add_argument('--start', default=0,
+    parser.add_argument('infile', help='path and filename of the input notebook file ("-" for stdin).')
+    parser.add_argument('outfile', help='path and filename of the output LaTeX file ("-" for stdout).')
+    parser.add_argument('--start', default=0, type=_cellarg,
                         help='''int or string.
 int: Cells before cell `start` are ignored.
 string: Cells before the first cell with exactly this content are ignored.''')
-    parser.add_argument('--stop', default=1e5,
+    parser.add_argument('--stop', default=1e5, type=_cellarg,
                         help='''int or string.
 int: Cells after cell `stop` are ignored.
 string: Cells after the first cell with exactly this content are ignored.''')
@@ -355,13 +896,97 @@ string: Cells after the first cell with exactly this content are ignored.''')
                         help='Content of this file will be pasted before the notebook conversion. This can be used to store e.g. LaTeX headers in a separate file.')
     parser.add_argument('--file_after',
                         help='Content of this file will be pasted at the end.')
+    parser.add_argument('--range', nargs=3, action='append', default=[],
+                        metavar=('START', 'STOP', 'OUTFILE'),
+                        help='Also write the cells between START and STOP to OUTFILE. Can be given several times; the notebook is only read once.')
+    parser.add_argument('--also', nargs=2, action='append', default=[],
+                        metavar=('FORMAT', 'OUTFILE'),
+                        help='Also write the cells between --start and --stop to OUTFILE as {0}. Can be given several times; the notebook is only read and converted once.'.format(' or '.join(sorted(EMITTERS))))
+    parser.add_argument('--bib', action='append', default=[], metavar='BIBFILE',
+                        help='Warn about citations that are not in this .bib file. Can be given several times.')
+    parser.add_argument('--crossref', metavar='FILE',
+                        help='Write all labels, references and citations (with the numbers of the cells they are in) and the problems found with them to this JSON file.')
+    parser.add_argument('--spill_size', type=int, metavar='KB',
+                        help='Write code outputs larger than KB kilobytes (e.g. long tables) to files of their own next to the LaTeX file and \\input them. The \\input only has the name of the file, so LaTeX has to run in the directory of the LaTeX file. Files from earlier runs that are no longer used are removed.')
+    parser.add_argument('--cache',
+                        help='Keep the converted content of each cell in this file and reuse it for unchanged cells when run again.')
+    parser.add_argument('--cache_size', type=int, default=32,
+                        help='Maximal size of the cache in MB.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and convert again whenever the notebook (or `file_before` or `file_after`) is saved.')
+    parser.add_argument('--server', nargs='?', const=None, default=False, metavar='SOCKET',
+                        help='Let a running ipythontools-server do the conversion (default socket: ipythontools-<uid>.sock in $XDG_RUNTIME_DIR or the temporary directory). If there is no server, convert here.')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE',
+                        help='Report how long reading, converting and writing took, per cell type and converter, and which cells were slowest. Written as a table to stderr or to FILE (as JSON if FILE ends in .json).')
     args = parser.parse_args()
+    if args.watch and args.infile == '-':
+        parser.error('--watch needs a notebook file, not stdin.')
+    for fmt, outfile in args.also:
+        if fmt not in EMITTERS:
+            parser.error('Unknown format for --also: {0} (known formats: {1})'.format(
+                fmt, ', '.join(sorted(EMITTERS))))
+
+    ranges = [(args.start, args.stop, args.outfile)] + \
+        [(_cellarg(start), _cellarg(stop), outfile) for start, stop, outfile in args.range] + \
+        [(args.start, args.stop, outfile, fmt) for fmt, outfile in args.also]
+    spill_size = None if args.spill_size is None else args.spill_size * 1024
+    if (args.server is not False) and not args.watch and (args.profile is None) and \
+            ('-' not in [args.infile] + [r[2] for r in ranges]):
+        absolute = lambda filename: None if filename is None else os.path.abspath(filename)
+        try:
+            result = client.request('convert', path=args.server, infile=absolute(args.infile),
+                                    ranges=[(r[0], r[1], absolute(r[2])) + tuple(r[3:]) for r in ranges],
+                                    file_before=absolute(args.file_before),
+                                    file_after=absolute(args.file_after),
+                                    bibfiles=[absolute(b) for b in args.bib],
+                                    crossref=absolute(args.crossref), spill_size=spill_size)
+        except OSError as e:
+            print('No server at {0} ({1}), converting here.'.format(args.server or 'the default socket', e),
+                  file=sys.stderr)
+        except RuntimeError as e:
+            print('Conversion failed: ', e, file=sys.stderr)
+            sys.exit(1)
+        else:
+            sys.stdout.write(result['log'])
+            sys.exit()
 
     converter = NotebookConverter()
-    converter.convert(infile=args.infile, outfile=args.outfile,
-                      start=args.start, stop=args.stop,
-                      file_before=args.file_before, file_after=args.file_after)
-    sys.exit()
+    if args.cache is not None:
+        converter.cache = ConversionCache(args.cache, maxsize=args.cache_size * 2**20)
+    elif args.watch:
+        converter.cache = ConversionCache(None, maxsize=args.cache_size * 2**20)
+
+    def run():
+        if args.profile is not None:
+            converter.profile = ConversionProfile()
+        converter.convert_ranges(args.infile, ranges,
+                                 file_before=args.file_before, file_after=args.file_after,
+                                 bibfiles=args.bib, crossref=args.crossref, spill_size=spill_size)
+        if args.profile is not None:
+            converter.profile.write(args.profile)
+        if converter.cache is not None:
+            converter.cache.save()
+            print(converter.cache.stats(), file=sys.stderr if args.outfile == '-' else sys.stdout)
+            converter.cache.hits = 0
+            converter.cache.misses = 0
+
+    if not args.watch:
+        run()
+        sys.exit()
+
+    watched = [f for f in [args.infile, args.file_before, args.file_after] if f is not None]
+    changes = watch.changes(watched)
+    while True:
+        try:
+            run()
+        except Exception as e:
+            # The old output is still in place. Maybe the next save fixes it.
+            print('Conversion failed: ', repr(e))
+        print('Watching for changes (Ctrl-C to stop)...')
+        try:
+            next(changes)
+        except KeyboardInterrupt:
+            sys.exit()
 
 if __name__ == '__main__':
     jupyter2article()
\ No newline at end of file
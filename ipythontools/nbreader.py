@@ -0,0 +1,551 @@
+'''Read the cells of an IPython/Jupyter notebook one by one
+
+A notebook file is a single JSON document and the obvious way to read it is
+``json.load``. Unfortunately, that decodes *everything*, including the base64
+encoded ``image/png`` blobs of every plot ever made in the notebook. For the
+notebooks I write papers in, that's most of the file, and none of it is ever
+used by the converter or the spell checker.
+
+``NotebookReader`` scans the file incrementally and decodes one cell at a time.
+Output payloads that nobody asked for are skipped without decoding them, so
+memory use stays roughly constant, no matter how many plots a notebook holds.
+Both the current layout (``cells``) and the old layout
+(``worksheets[0].cells``) are understood.
+
+Each cell is returned as a ``Cell``, which looks the same for all versions
+of the notebook format (e.g. the source is always a list of lines), so the
+rest of the code does not need to check which version it has in front of it.
+
+The reader can also remember where in the file the source of each cell is.
+``source_patches`` and ``fileutils.splice`` use that to write a changed
+source back into the notebook without touching the rest of the file.
+'''
+import re
+import sys
+import json
+import functools
+
+from .fileutils import decompressing
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRUCTURE = re.compile(rb'["\[\]{}]')
+_SCALAR = re.compile(rb'[^,:\]} \t\n\r]*')
+
+
+class _JSONScanner(object):
+    '''Walk through a JSON document in a binary file without loading all of it.
+
+    Data is read in chunks of ``chunksize`` bytes. Bytes that are consumed are
+    dropped from the buffer, unless they are part of a value that is currently
+    decoded with ``read_value``.
+    '''
+    def __init__(self, f, chunksize=2**16):
+        self.f = f
+        self.chunksize = chunksize
+        self.buf = bytearray()
+        self.pos = 0
+        # file offset of self.buf[0]
+        self.offset = 0
+        # start of the value that is currently read (must be kept in buffer)
+        self.mark = None
+
+    def tell(self):
+        '''Offset in the file (in bytes) of the current position.'''
+        return self.offset + self.pos
+
+    def _fill(self):
+        keep = self.pos if self.mark is None else min(self.pos, self.mark)
+        if keep > 0:
+            del self.buf[:keep]
+            self.offset += keep
+            self.pos -= keep
+            if self.mark is not None:
+                self.mark -= keep
+        data = self.f.read(self.chunksize)
+        if not data:
+            return False
+        self.buf += data
+        return True
+
+    def _need(self, n=1):
+        '''Make sure that at least ``n`` bytes after ``pos`` are in the buffer.'''
+        while len(self.buf) - self.pos < n:
+            if not self._fill():
+                raise ValueError('Unexpected end of notebook file.')
+
+    def peek(self):
+        '''Skip white space and return the next character.'''
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos:self.pos + 1]
+            self._need()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('Expected {0!r} at byte {1} of notebook file.'.format(char, self.tell()))
+        self.pos += 1
+
+    def _skip_string(self):
+        # bytes.find is a lot faster than a regular expression on the long
+        # base64 strings that make up most of a notebook.
+        self.pos += 1
+        quote = None
+        while True:
+            if quote is None:
+                quote = self.buf.find(b'"', self.pos)
+            end = len(self.buf) if quote < 0 else quote
+            backslash = self.buf.find(b'\\', self.pos, end)
+            if backslash >= 0:
+                if backslash + 1 == quote:
+                    # escaped quotation mark
+                    self.pos = quote + 1
+                    quote = None
+                elif backslash + 1 < len(self.buf):
+                    self.pos = backslash + 2
+                else:
+                    self.pos = backslash
+                    self._need(2)
+                    self.pos += 2
+                    quote = None
+            elif quote >= 0:
+                self.pos = quote + 1
+                return
+            else:
+                self.pos = len(self.buf)
+                self._need()
+                quote = None
+
+    def skip_value(self):
+        '''Move past the next value without decoding it.'''
+        char = self.peek()
+        if char == b'"':
+            self._skip_string()
+        elif char in (b'[', b'{'):
+            self.pos += 1
+            depth = 1
+            while depth > 0:
+                match = _STRUCTURE.search(self.buf, self.pos)
+                if match is None:
+                    self.pos = len(self.buf)
+                    self._need()
+                    continue
+                char = match.group()
+                if char == b'"':
+                    self.pos = match.start()
+                    self._skip_string()
+                    continue
+                self.pos = match.end()
+                depth += 1 if char in (b'[', b'{') else -1
+        else:
+            # number, true, false, null
+            while True:
+                self.pos = _SCALAR.match(self.buf, self.pos).end()
+                if (self.pos < len(self.buf)) or not self._fill():
+                    break
+
+    def read_value(self):
+        '''Decode the next value.'''
+        self.peek()
+        self.mark = self.pos
+        try:
+            self.skip_value()
+            return json.loads(bytes(self.buf[self.mark:self.pos]).decode('utf-8'))
+        finally:
+            self.mark = None
+
+    def iter_object(self):
+        '''Yield the keys of a JSON object.
+
+        The caller has to consume the value of each key (with ``read_value``,
+        ``skip_value`` or similar) before asking for the next key.
+        '''
+        self.expect(b'{')
+        if self.peek() == b'}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(b':')
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == b'}':
+                return
+            elif char != b',':
+                raise ValueError('Malformed object at byte {0} of notebook file.'.format(self.tell()))
+
+    def iter_array(self):
+        '''Yield the index of each element of a JSON array.
+
+        The caller has to consume the element before asking for the next one.
+        '''
+        self.expect(b'[')
+        if self.peek() == b']':
+            self.pos += 1
+            return
+        i = 0
+        while True:
+            yield i
+            i += 1
+            char = self.peek()
+            self.pos += 1
+            if char == b']':
+                return
+            elif char != b',':
+                raise ValueError('Malformed array at byte {0} of notebook file.'.format(self.tell()))
+
+
+_CELLSLOTS = {'cell_type': 'cell_type', 'id': 'id', 'source': 'source', 'input': 'source',
+              'level': 'level', 'metadata': 'metadata', 'execution_count': 'execution_count',
+              'prompt_number': 'execution_count'}
+'''Keys of a cell in the notebook file and the attribute of ``Cell`` they are stored in.'''
+
+
+def _lines(source):
+    if isinstance(source, str):
+        return source.splitlines(True)
+    return source
+
+
+class Cell(object):
+    r'''One cell of a notebook, in the same form for every notebook format.
+
+    Notebook formats differ in the details: Old notebooks call the source of
+    a code cell ``input`` and the execution count ``prompt_number``, and the
+    source can be a list of lines or a single string. ``Cell`` irons that
+    out once, when the cell is read, so code that works with cells does not
+    need to care:
+
+    - ``source`` is always a list of lines (every line but the last ends
+      with ``\n``),
+    - ``outputs`` is a list of outputs (empty for cells without outputs).
+      ``NotebookReader`` reads the outputs of a seekable file only when
+      they are first used.
+    - ``level`` is the level of (old-style) heading cells, ``None`` otherwise.
+
+    All other keys of the cell are kept in the dictionary ``extra`` (or
+    ``None``, if there are none).
+    Cells use ``__slots__`` to keep notebooks with many cells small in memory.
+
+    For code written for the cell dictionaries of the notebook file, cells
+    can also be used like a dictionary: ``cell['source']`` (or
+    ``cell['input']``), ``cell.get('level')``, ``cell.items()`` etc.
+    Attributes that are ``None`` are missing in this view.
+    '''
+    __slots__ = ('cell_type', 'id', 'source', 'level', 'metadata', 'execution_count',
+                 'extra', '_outputs')
+
+    def __init__(self, cell_type=None, source=(), outputs=None, level=None, metadata=None,
+                 execution_count=None, extra=None):
+        self.cell_type = sys.intern(cell_type) if isinstance(cell_type, str) else cell_type
+        self.id = None
+        self.source = list(_lines(source))
+        self.level = level
+        self.metadata = metadata
+        self.execution_count = execution_count
+        self.extra = extra
+        self._outputs = outputs
+
+    @classmethod
+    def from_dict(cls, cell):
+        '''Make a ``Cell`` from a cell dictionary as in the notebook file.'''
+        new = cls()
+        for key, value in cell.items():
+            new[key] = value
+        return new
+
+    @property
+    def outputs(self):
+        outputs = self._outputs
+        if callable(outputs):
+            outputs = self._outputs = outputs()
+        return [] if outputs is None else outputs
+
+    @outputs.setter
+    def outputs(self, outputs):
+        self._outputs = outputs
+
+    def keys(self):
+        keys = [key for key in ('cell_type', 'id', 'source', 'level', 'metadata', 'execution_count')
+                if getattr(self, key) is not None]
+        if self._outputs is not None:
+            keys.append('outputs')
+        if self.extra is not None:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __getitem__(self, key):
+        if key == 'outputs':
+            if self._outputs is None:
+                raise KeyError(key)
+            return self.outputs
+        slot = _CELLSLOTS.get(key)
+        if slot is None:
+            if self.extra is None:
+                raise KeyError(key)
+            return self.extra[key]
+        value = getattr(self, slot)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key == 'outputs':
+            self._outputs = value
+            return
+        slot = _CELLSLOTS.get(key)
+        if slot is None:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+        elif slot == 'source':
+            self.source = _lines(value)
+        elif slot == 'cell_type':
+            self.cell_type = sys.intern(value) if isinstance(value, str) else value
+        else:
+            setattr(self, slot, value)
+
+    def __repr__(self):
+        return 'Cell(cell_type={0!r}, source={1!r})'.format(self.cell_type, self.source)
+
+
+def as_cell(cell):
+    '''Return ``cell`` as a ``Cell`` (converting a cell dictionary if necessary).'''
+    if isinstance(cell, Cell):
+        return cell
+    return Cell.from_dict(cell)
+
+
+class NotebookReader(object):
+    '''Iterate over the cells of a notebook without reading the whole file.
+
+    Each cell is returned as a ``Cell``, with only the outputs that are needed.
+
+    Parameters
+    ----------
+    f : file object
+        Notebook file, opened in binary mode. Compressed files (gzip, xz,
+        bz2, zstd) are recognized by their first bytes and decompressed
+        on the fly (see ``fileutils.decompressing``); positions in
+        ``source_spans`` then refer to the decompressed content.
+    needs_outputs : callable or None
+        Called with a code cell (that has its source, but no outputs yet).
+        If it returns ``False`` the outputs of that cell are skipped and
+        the cell gets an empty list of ``outputs``.
+        If ``None``, the outputs of every code cell are available.
+    seekable : bool or None
+        In the current notebook format, the ``outputs`` of a cell are stored
+        *before* its ``source``. If the file is seekable, outputs are
+        skipped at first, and only read (by going back in the file) when
+        ``Cell.outputs`` is used for the first time. If the file was closed
+        by then, it is opened again by its name.
+        Otherwise, the textual part of each output is read and dropped
+        again if ``needs_outputs`` says that it is not needed.
+        ``None`` means ``f.seekable()``.
+    record_sources : bool
+        If ``True``, the position of the ``source`` (or ``input``) of each
+        cell in the file is appended to ``source_spans`` (``None`` for cells
+        without source), see ``source_patches``.
+    '''
+
+    output_keys = ('output_type', 'name', 'stream', 'text', 'latex', 'data',
+                   'metadata', 'execution_count', 'prompt_number')
+    '''Keys of an output that are read. Everything else (e.g. the ``png`` of
+    old notebooks) is skipped.'''
+
+    output_mimetypes = ('text/plain', 'text/latex')
+    '''Entries of the ``data`` MIME bundle of an output that are read.'''
+
+    def __init__(self, f, needs_outputs=None, seekable=None, record_sources=False,
+                 chunksize=2**16):
+        f = decompressing(f)
+        self.f = f
+        self.needs_outputs = needs_outputs
+        if seekable is None:
+            try:
+                seekable = f.seekable()
+            except AttributeError:
+                seekable = False
+        self.seekable = seekable
+        self.scanner = _JSONScanner(f, chunksize=chunksize)
+        self.metadata = {}
+        self.record_sources = record_sources
+        self.source_spans = []
+
+    def __iter__(self):
+        scanner = self.scanner
+        for key in scanner.iter_object():
+            if key == 'cells':
+                # newer versions of notebook
+                for cell in self._iter_cells():
+                    yield cell
+            elif key == 'worksheets':
+                # notebook format 1
+                for i in scanner.iter_array():
+                    if i > 0:
+                        scanner.skip_value()
+                        continue
+                    for wskey in scanner.iter_object():
+                        if wskey == 'cells':
+                            for cell in self._iter_cells():
+                                yield cell
+                        else:
+                            scanner.skip_value()
+            elif key in ('metadata', 'nbformat', 'nbformat_minor'):
+                self.metadata[key] = scanner.read_value()
+            else:
+                scanner.skip_value()
+
+    def _iter_cells(self):
+        for i in self.scanner.iter_array():
+            yield self._read_cell()
+
+    def _wants_outputs(self, cell):
+        if cell.cell_type != 'code':
+            return False
+        return (self.needs_outputs is None) or self.needs_outputs(cell)
+
+    def _read_cell(self):
+        scanner = self.scanner
+        cell = Cell()
+        hassource = False
+        deferred = None
+        span = None
+        for key in scanner.iter_object():
+            if key == 'outputs':
+                if hassource:
+                    # Older version of notebook: Source comes first.
+                    if self._wants_outputs(cell):
+                        cell.outputs = self._read_outputs(scanner)
+                    else:
+                        scanner.skip_value()
+                        cell.outputs = []
+                elif self.seekable:
+                    scanner.peek()
+                    deferred = scanner.tell()
+                    scanner.skip_value()
+                    cell.outputs = []
+                else:
+                    cell.outputs = self._read_outputs(scanner)
+            elif key == 'attachments':
+                # images pasted into markdown cells
+                scanner.skip_value()
+            elif key in ('source', 'input'):
+                if self.record_sources:
+                    cell.source, span = self._read_source(scanner)
+                    cell.source = _lines(cell.source)
+                else:
+                    cell.source = _lines(scanner.read_value())
+                hassource = True
+            else:
+                cell[key] = scanner.read_value()
+
+        if (cell._outputs is not None) and not self._wants_outputs(cell):
+            cell.outputs = []
+        elif deferred is not None:
+            cell.outputs = functools.partial(self._read_outputs_at, deferred)
+        if self.record_sources:
+            self.source_spans.append(span)
+        return cell
+
+    def _read_outputs_at(self, offset):
+        '''Read the outputs that start at byte ``offset`` of the file.'''
+        f = self.f
+        if f.closed:
+            with open(f.name, 'rb') as f:
+                f.seek(offset)
+                return self._read_outputs(_JSONScanner(f, chunksize=self.scanner.chunksize))
+        here = f.tell()
+        f.seek(offset)
+        try:
+            return self._read_outputs(_JSONScanner(f, chunksize=self.scanner.chunksize))
+        finally:
+            f.seek(here)
+
+    def _read_source(self, scanner):
+        '''Read source and return it together with its position in the file.'''
+        char = scanner.peek()
+        start = scanner.tell()
+        if char != b'[':
+            source = scanner.read_value()
+            return source, (start, scanner.tell(), None)
+        source = []
+        items = []
+        for i in scanner.iter_array():
+            scanner.peek()
+            itemstart = scanner.tell()
+            source.append(scanner.read_value())
+            items.append((itemstart, scanner.tell()))
+        return source, (start, scanner.tell(), items)
+
+    def _read_outputs(self, scanner):
+        outputs = []
+        for i in scanner.iter_array():
+            out = {}
+            for key in scanner.iter_object():
+                if key == 'data':
+                    data = {}
+                    for mimetype in scanner.iter_object():
+                        if mimetype in self.output_mimetypes:
+                            data[mimetype] = scanner.read_value()
+                        else:
+                            scanner.skip_value()
+                    out['data'] = data
+                elif key in self.output_keys:
+                    out[key] = scanner.read_value()
+                else:
+                    scanner.skip_value()
+            outputs.append(out)
+        return outputs
+
+
+def _dumps(value):
+    # The notebook server writes non-ASCII characters as they are
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
+
+
+def source_patches(span, old, new):
+    '''Return the changes to a notebook file that replace the source of a cell.
+
+    Only the strings that differ between ``old`` and ``new`` are replaced, so
+    the formatting of the file stays the same. If the number of lines
+    changed, the whole source is replaced. A source that is a single string
+    in the file stays a single string.
+
+    Parameters
+    ----------
+    span : tuple
+        Position of the source in the file, from ``NotebookReader.source_spans``.
+    old : list of strings or string
+        Source as it was read.
+    new : list of strings or string
+        Source that should be in the file.
+
+    Returns
+    -------
+    patches : list
+        ``(start, end, data)`` for each piece of the file that should be
+        replaced by the bytes ``data``, see ``fileutils.splice``.
+    '''
+    if old == new:
+        return []
+    start, end, items = span
+    if (items is None) and isinstance(new, list):
+        new = ''.join(new)
+    if (items is not None) and isinstance(new, list) and (len(new) == len(items)):
+        return [(itemstart, itemend, _dumps(n))
+                for (itemstart, itemend), o, n in zip(items, old, new) if o != n]
+    return [(start, end, _dumps(new))]
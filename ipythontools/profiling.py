@@ -0,0 +1,185 @@
+'''Find out where the time of a conversion goes
+
+Give a ``ConversionProfile`` to a ``NotebookConverter`` (or run
+``jupyter2article --profile``) and it records:
+
+- how long reading the notebook (including outputs that are only read
+  when a converter needs them), finding the cells in range, converting
+  and writing took,
+- how often each cell converter was called and how long it took,
+- how many cells and bytes of each cell type were read and how much LaTeX
+  came out of them,
+- the cells that took longest to convert.
+
+``table`` formats all of that for a build log, ``as_dict`` returns it for
+``json.dump`` and ``write`` does either, so that numbers from different runs
+can be compared.
+Profiling costs a little time itself, so it is off unless asked for.
+'''
+import os
+import sys
+import json
+import time
+import heapq
+import threading
+from collections import OrderedDict
+
+
+class ConversionProfile(object):
+    '''Timings and counts for one or more conversions.
+
+    Parameters
+    ----------
+    slowest : int
+        Number of slowest cells to remember.
+    '''
+    phasenames = ['load', 'templates', 'index', 'convert', 'write']
+    '''Phases of a conversion, in the order they are listed.'''
+
+    def __init__(self, slowest=10):
+        self.slowest = slowest
+        self.phases = OrderedDict((name, 0.) for name in self.phasenames)
+        self.total = 0.
+        self.converters = {}
+        self.celltypes = {}
+        self._slowcells = []
+        # Conversions in several threads can add to the same profile
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled, e.g. to send the profile to a worker process
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_time(self, phase, seconds):
+        '''Add ``seconds`` to the time spent in ``phase``.'''
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.) + seconds
+
+    def add_total(self, seconds):
+        '''Add the wall time of a whole conversion.'''
+        with self._lock:
+            self.total += seconds
+
+    def _celltype(self, celltype):
+        entry = self.celltypes.get(celltype)
+        if entry is None:
+            entry = {'cells': 0, 'converted': 0, 'bytes_in': 0, 'bytes_out': 0, 'time': 0.}
+            self.celltypes[celltype] = entry
+        return entry
+
+    def read(self, reader):
+        '''Yield the cells from a ``NotebookReader``, timing how long each one takes to read.'''
+        cells = iter(reader)
+        pos = reader.scanner.tell()
+        while True:
+            t0 = time.perf_counter()
+            try:
+                cell = next(cells)
+            except StopIteration:
+                self.add_time('load', time.perf_counter() - t0)
+                return
+            seconds = time.perf_counter() - t0
+            newpos = reader.scanner.tell()
+            with self._lock:
+                self.phases['load'] += seconds
+                entry = self._celltype(cell.cell_type)
+                entry['cells'] += 1
+                entry['bytes_in'] += newpos - pos
+            pos = newpos
+            yield cell
+
+    def read_outputs(self, cell):
+        '''Read the outputs of ``cell`` now, if the reader put that off, and time it.
+
+        ``NotebookReader`` reads outputs of v4 notebooks only when they are
+        used. Without this, that time would count as converting the cell.
+        '''
+        t0 = time.perf_counter()
+        cell.outputs
+        self.add_time('load', time.perf_counter() - t0)
+
+    def add_cell(self, notebook, i, cell, converter, seconds, text):
+        '''Record the conversion of cell number ``i`` of ``notebook`` into ``text``.
+
+        ``text`` is the output in one format (LaTeX, if that is written), so
+        that writing more formats does not increase ``bytes_out``.
+        '''
+        celltype = cell.cell_type
+        name = type(converter).__name__
+        with self._lock:
+            self.phases['convert'] += seconds
+            entry = self._celltype(celltype)
+            entry['converted'] += 1
+            entry['bytes_out'] += len(text.encode('utf-8'))
+            entry['time'] += seconds
+            calls = self.converters.setdefault(name, {'calls': 0, 'time': 0.})
+            calls['calls'] += 1
+            calls['time'] += seconds
+            item = (seconds, notebook, i, celltype)
+            if len(self._slowcells) < self.slowest:
+                heapq.heappush(self._slowcells, item)
+            elif item > self._slowcells[0]:
+                heapq.heapreplace(self._slowcells, item)
+
+    def slowcells(self):
+        '''Return the slowest cells, slowest first.'''
+        with self._lock:
+            cells = sorted(self._slowcells, reverse=True)
+        return [{'notebook': notebook, 'cell': i, 'cell_type': celltype, 'time': seconds}
+                for seconds, notebook, i, celltype in cells]
+
+    def as_dict(self):
+        '''Return all numbers as a dictionary that can be written with ``json.dump``.'''
+        slowcells = self.slowcells()
+        with self._lock:
+            return {'total': self.total,
+                    'phases': dict(self.phases),
+                    'converters': dict((k, dict(v)) for k, v in self.converters.items()),
+                    'celltypes': dict((k, dict(v)) for k, v in self.celltypes.items()),
+                    'slowest_cells': slowcells}
+
+    def table(self):
+        '''Format the profile as a human readable table.'''
+        d = self.as_dict()
+        lines = ['{0:<28} {1:>10}'.format('Phase', 'Time [s]')]
+        for name, seconds in d['phases'].items():
+            lines.append('{0:<28} {1:>10.4f}'.format(name, seconds))
+        lines.append('{0:<28} {1:>10.4f}'.format('other', d['total'] - sum(d['phases'].values())))
+        lines.append('{0:<28} {1:>10.4f}'.format('total', d['total']))
+        lines.append('')
+        lines.append('{0:<28} {1:>8} {2:>10} {3:>12} {4:>12} {5:>10}'.format(
+            'Cell type', 'Cells', 'Converted', 'Bytes in', 'Bytes out', 'Time [s]'))
+        for name in sorted(d['celltypes'], key=str):
+            lines.append('{0:<28} {cells:>8} {converted:>10} {bytes_in:>12} {bytes_out:>12} {time:>10.4f}'.format(
+                str(name), **d['celltypes'][name]))
+        lines.append('')
+        lines.append('{0:<28} {1:>8} {2:>10}'.format('Converter', 'Calls', 'Time [s]'))
+        for name in sorted(d['converters']):
+            lines.append('{0:<28} {calls:>8} {time:>10.4f}'.format(name, **d['converters'][name]))
+        lines.append('')
+        lines.append('{0:<28} {1:>8} {2:<10} {3:>10}'.format('Slowest cells', 'Cell', 'Type', 'Time [ms]'))
+        for c in d['slowest_cells']:
+            lines.append('{0:<28} {1:>8} {2:<10} {3:>10.3f}'.format(
+                os.path.basename(str(c['notebook']))[-28:], c['cell'], str(c['cell_type']), c['time'] * 1000))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, outfile):
+        '''Write the profile to a file (JSON if the name ends in ``.json``, else a table).
+
+        ``'-'`` writes the table to stderr, so that it does not mix with LaTeX
+        written to stdout.
+        '''
+        if outfile == '-':
+            sys.stderr.write(self.table())
+        elif outfile.lower().endswith('.json'):
+            with open(outfile, 'w', encoding='utf-8') as f:
+                json.dump(self.as_dict(), f, indent=1)
+        else:
+            with open(outfile, 'w', encoding='utf-8') as f:
+                f.write(self.table())
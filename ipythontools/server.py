@@ -0,0 +1,204 @@
+'''Keep converters and dictionaries loaded between runs
+
+My editor runs ``jupyter2article`` every time I save a notebook, and
+``jupyterspellcheck --report`` to underline misspelled words. Each of those
+runs starts python, imports everything and (for the spell checker) loads
+the Enchant dictionaries again, which takes a lot longer than the actual
+conversion of the one cell that changed.
+
+``ipythontools-server`` does all of that once and then waits for requests
+on a Unix domain socket. It keeps a ``NotebookConverter`` (with a cache of
+converted cells in memory) and a dictionary for each language and personal
+word list. Requests are handled concurrently in a pool of threads.
+
+Start it with::
+
+    > ipythontools-server &
+
+and add ``--server`` to the usual commands::
+
+    > jupyter2article --server myanalysis.ipynb myanalysis.tex
+    > jupyterspellcheck --server --report typos.json myanalysis.ipynb
+
+If no server is running, they just do the work themselves.
+
+The protocol is simple: The client sends one JSON object per line,
+``{"command": ..., "args": {...}}``, and gets back one line of JSON, either
+``{"ok": true, "result": ...}`` or ``{"ok": false, "error": "..."}``.
+See ``client.request`` and the ``do_...`` methods of ``Server`` for the
+commands.
+'''
+import io
+import os
+import sys
+import json
+import signal
+import asyncio
+import argparse
+import threading
+from collections import namedtuple
+from concurrent import futures
+
+from .jupyter2article import NotebookConverter
+from .cache import ConversionCache
+from .nbreader import NotebookReader
+from . import client
+
+_Checker = namedtuple('_Checker', ['dictid', 'wordchecker', 'tokenizer', 'lock'])
+
+
+class Server(object):
+    '''Convert and spell check notebooks on request.
+
+    Parameters
+    ----------
+    path : string or None
+        Filename of the socket (default: ``client.default_socket()``).
+    converter : ``NotebookConverter`` or None
+        Converter for all ``convert`` requests. By default, a converter with
+        an in-memory cache of ``cache_size`` MB.
+    workers : int or None
+        Maximal number of requests that are handled at the same time.
+    '''
+    def __init__(self, path=None, converter=None, cache_size=32, workers=None):
+        self.path = client.default_socket() if path is None else path
+        if converter is None:
+            converter = NotebookConverter(cache=ConversionCache(None, maxsize=cache_size * 2**20))
+        self.converter = converter
+        self.checkers = {}
+        self._lock = threading.Lock()
+        self.executor = futures.ThreadPoolExecutor(max_workers=workers)
+        self._stop = None
+
+    def do_convert(self, infile, ranges, file_before=None, file_after=None, bibfiles=None,
+                   crossref=None, spill_size=None):
+        '''Run ``NotebookConverter.convert_ranges`` and return the messages it printed.'''
+        log = io.StringIO()
+        changed = self.converter.convert_ranges(infile, ranges, file_before=file_before,
+                                                file_after=file_after, log=log,
+                                                bibfiles=bibfiles, crossref=crossref,
+                                                spill_size=spill_size)
+        return {'changed': changed, 'log': log.getvalue()}
+
+    def do_check(self, files, lang=None, pwl=None):
+        '''Spell check notebooks and return the report (see ``spellchecker.check_notebooks``).'''
+        # Only the spell checker needs enchant, so converting works without it
+        from . import spellchecker
+        checker = self._checker(spellchecker.LANGUAGE if lang is None else lang, pwl)
+        report = []
+        for filename in files:
+            with open(filename, 'rb') as f, checker.lock:
+                misspellings = spellchecker.find_misspellings(
+                    NotebookReader(f, needs_outputs=lambda cell: False),
+                    checker.wordchecker, checker.tokenizer)
+            for m in misspellings:
+                m['notebook'] = filename
+                report.append(m)
+        return report
+
+    def do_ping(self):
+        return {'pid': os.getpid(), 'languages': sorted(set(k[0] for k in self.checkers)),
+                'cache': None if self.converter.cache is None else self.converter.cache.stats()}
+
+    def _checker(self, lang, pwl):
+        '''Return the loaded dictionary for ``lang`` and ``pwl``.
+
+        The dictionary is loaded again if the personal word list changed.
+        '''
+        from . import spellchecker
+        with self._lock:
+            checker = self.checkers.get((lang, pwl))
+            if (checker is None) or \
+                    (spellchecker.dictionary_id(checker.wordchecker.dict, pwl) != checker.dictid):
+                dictionary = spellchecker.get_dictionary(lang, pwl)
+                checker = _Checker(spellchecker.dictionary_id(dictionary, pwl),
+                                   spellchecker.WordChecker(dictionary),
+                                   spellchecker.get_tokenizer(lang), threading.Lock())
+                self.checkers[(lang, pwl)] = checker
+            return checker
+
+    def _dispatch(self, request):
+        method = getattr(self, 'do_' + str(request.get('command')), None)
+        if method is None:
+            raise ValueError('Unknown command: {0!r}'.format(request.get('command')))
+        return method(**request.get('args', {}))
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                shutdown = False
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    shutdown = request.get('command') == 'shutdown'
+                    result = None
+                    if not shutdown:
+                        result = await loop.run_in_executor(self.executor, self._dispatch, request)
+                    response = {'ok': True, 'result': result}
+                except Exception as e:
+                    response = {'ok': False, 'error': '{0}: {1}'.format(type(e).__name__, e)}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+                if shutdown:
+                    self._stop.set()
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self):
+        '''Handle requests until ``shutdown`` is requested or the process is stopped.'''
+        self._stop = asyncio.Event()
+        if os.path.exists(self.path):
+            try:
+                client.request('ping', path=self.path)
+            except OSError:
+                # left over from a server that did not shut down cleanly
+                os.remove(self.path)
+            else:
+                raise RuntimeError('Another server is already running at ' + self.path)
+        # The server writes files where it is told to, so only this user may
+        # talk to it. The socket has to be private from the moment it exists.
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._handle, path=self.path)
+        finally:
+            os.umask(umask)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+        try:
+            async with server:
+                await self._stop.wait()
+        finally:
+            os.remove(self.path)
+            self.executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='''Keep the notebook converter and spell checker loaded and serve requests from jupyter2article --server and jupyterspellcheck --server.''')
+    parser.add_argument('--socket',
+                        help='Filename of the Unix domain socket (default: ipythontools-<uid>.sock in $XDG_RUNTIME_DIR or the temporary directory).')
+    parser.add_argument('--cache', help='Load the cache of converted cells from this file at start and save it at the end.')
+    parser.add_argument('--cache_size', type=int, default=32,
+                        help='Maximal size of the cache in MB.')
+    parser.add_argument('--workers', type=int, help='Maximal number of requests that are handled at the same time.')
+    args = parser.parse_args()
+
+    server = Server(args.socket, cache_size=args.cache_size, workers=args.workers)
+    if args.cache is not None:
+        server.converter.cache = ConversionCache(args.cache, maxsize=args.cache_size * 2**20)
+    print('Listening on ', server.path)
+    try:
+        asyncio.run(server.serve())
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if args.cache is not None:
+        server.converter.cache.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-'''Spell check the markdown text in IPython notebooks
+r'''Spell check the markdown text in IPython notebooks
 
 As much as I love the IPython notebook, there is one big drawback (at least in
 my installation). When I type into a cell in the browser (I use firefox) there
@@ -35,10 +35,11 @@ English much better I define a custom filter function that
 makes sure that strings which look like LaTeX commands will not be spell checked
 (since very few LaTeX command are valid English words so that would give a lot of
 apparent typos).
-More complicated filters that avoid spell checking within equations or
-commands like ``\label{XXX}`` or ``\cite{}`` are possible (they would be called
-a ``chunker`` in ``pyenchant``). Check the `github repository <https://github.com/hamogu/ipythontools>`_
-for this code if you want to see if I have an improved version.
+On top of that, a ``chunker`` (that's what ``pyenchant`` calls it) skips
+everything within equations (``$...$``, ``\begin{equation}`` etc.) and the
+arguments of commands like ``\label{XXX}``, ``\ref{}`` or ``\cite{}``,
+which are not English either. Because equations can span several lines,
+each cell is checked as a whole and not line by line.
 
 
 How to use this script
@@ -49,59 +50,619 @@ the command line::
     > jupyterspellcheck filein.ipynb fileout.ipynb
 
 Open the new file in IPython, run all cells again and keep working.
+While you decide what to do with one word, suggestions for the next misspelled
+words are already looked up in the background. When you correct a word, the
+same correction is applied to every later instance of that word without
+asking again.
 
 `filein` and `fileout` can be the same filename (in this case the old file will get
 overwritten with the spelling corrected version), but I recommend to keep a copy
 just in case something gets screwed up.
+Only the corrected lines are changed in the file, everything else (including
+the formatting) stays exactly as it was, so ``git diff`` shows just the
+corrections. If nothing was corrected, the notebook is not written at all.
+Compressed notebooks (``.ipynb.gz``, ``.ipynb.xz``, ...) can be checked
+directly, and ``fileout`` is compressed if its name ends in ``.gz``,
+``.xz``, ``.bz2`` or ``.zst``.
+
+Cells that passed the spell check are remembered in a small file next to the
+output (``fileout.ipynb.spellcheck.json``, or wherever ``--sidecar`` says), so
+the next run only asks about cells that were edited since. If the dictionary
+or the personal word list (``--pwl``, or enchant's own list of words added
+with ``a``) changes, all cells are checked again;
+``--recheck`` does the same on request. Quitting with ``q`` keeps the
+corrections made so far; the cell you quit in and all after it are checked
+again next time.
+
+To check notebooks without any questions (e.g. in continuous integration),
+write a report of all misspelled words instead::
+
+    > jupyterspellcheck --report typos.json chapter*.ipynb
+
+Each distinct word is only looked up once and notebooks are checked in
+parallel. The report lists notebook, cell, line and column for each misspelled
+word (use a filename ending in ``.csv`` for a CSV file). The exit status is
+1 if there are any misspelled words.
 '''
 from __future__ import print_function
 
 import re
+import csv
+import array
+import bisect
 import json
 import sys
+import os
 import argparse
+import hashlib
+import threading
+from concurrent import futures
 
 import enchant
 import enchant.tokenize
 import enchant.checker
 from enchant.checker.CmdLineChecker import CmdLineChecker
 
+from .nbreader import NotebookReader, source_patches
+from .fileutils import AtomicWriter, splice
+from . import client
+
+LANGUAGE = 'en_US'
+TEXTCELLS = ['markdown', 'raw', 'heading']
+'''Cell types that are spell checked.'''
+
+
 class LatexCommandFilter(enchant.tokenize.EmailFilter):
     _pattern = re.compile(r"\\([^a-zA-Z]|[a-zA-Z]+)")
 
+
+_MATHENVS = ['equation', 'eqnarray', 'align', 'alignat', 'flalign', 'gather',
+             'multline', 'displaymath', 'math']
+'''Environments whose content is math and is not spell checked.'''
+
+_ARGCOMMANDS = [r'[a-zA-Z]*ref', r'cite[a-zA-Z]*', 'nocite', 'label', 'includegraphics',
+                'plotone', 'plottwo', 'url', 'input', 'include', 'bibliography',
+                'bibliographystyle', 'usepackage', 'documentclass', 'begin', 'end']
+'''Commands whose arguments (labels, keys, filenames) are not spell checked.'''
+
+_LATEX = re.compile(r"""
+    (?P<escaped>\\[\\$%{}])
+  | (?P<display>\$\$) | (?P<inline>\$) | (?P<paren>\\\() | (?P<bracket>\\\[)
+  | \\begin\s*\{(?P<env>(?:""" + '|'.join(_MATHENVS) + r""")\*?)\}
+  | \\(?:""" + '|'.join(_ARGCOMMANDS) + r""")(?![a-zA-Z])\*?\s*(?:\[[^\]]*\]\s*)*(?P<arg>\{)
+""", re.VERBOSE)
+
+_MATHEND = {'display': re.compile(r'(?<!\\)\$\$'), 'inline': re.compile(r'(?<!\\)\$'),
+            'paren': re.compile(r'\\\)'), 'bracket': re.compile(r'\\\]')}
+
+
+def _closing_brace(text, pos):
+    '''Return position after the brace that closes the group opened before ``pos``.'''
+    depth = 1
+    while pos < len(text):
+        c = text[pos]
+        if c == '\\':
+            pos += 1
+        elif c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        pos += 1
+    return len(text)
+
+
+class LatexChunker(enchant.tokenize.Chunker):
+    '''Chunker that skips math and the arguments of references in LaTeX.
+
+    Text in ``$...$``, ``$$...$$``, ``\\(...\\)``, ``\\[...\\]`` and math
+    environments like ``equation`` is not passed on to the spell checker,
+    and neither are the arguments of commands like ``\\label``, ``\\ref``,
+    ``\\cite`` or ``\\includegraphics``. These can span several lines, so
+    the chunker should be given the text of a whole cell at once.
+
+    ``enchant.checker.SpellChecker`` hands the text in as an ``array`` and
+    changes it in place when a word is replaced, so the text is scanned as
+    a string that is made again after each replacement.
+    '''
+    def __init__(self, text):
+        enchant.tokenize.Chunker.__init__(self, text)
+        self._string = None
+
+    def set_offset(self, offset, replaced=False):
+        self._offset = offset
+        if replaced:
+            self._string = None
+
+    def _skipped(self, text, pos):
+        '''Return start and end of the next part of ``text`` that is not checked.'''
+        while True:
+            m = _LATEX.search(text, pos)
+            if m is None:
+                return len(text), len(text)
+            kind = m.lastgroup
+            if kind == 'escaped':
+                pos = m.end()
+            elif kind == 'arg':
+                return m.start(), _closing_brace(text, m.end())
+            elif kind == 'env':
+                end = re.compile(r'\\end\s*\{' + re.escape(m.group('env')) + r'\}').search(text, m.end())
+                return m.start(), len(text) if end is None else end.end()
+            else:
+                end = _MATHEND[kind].search(text, m.end())
+                if end is not None:
+                    return m.start(), end.end()
+                if kind != 'inline':
+                    return m.start(), len(text)
+                # A single $ is just a dollar sign
+                pos = m.end()
+
+    def next(self):
+        if self._string is None:
+            text = self._text
+            self._string = text.tounicode() if isinstance(text, array.array) else text
+        text = self._string
+        offset = self._offset
+        while offset < len(text):
+            start, end = self._skipped(text, offset)
+            if start > offset:
+                self._offset = end
+                return (self._text[offset:start], offset)
+            offset = end
+        self._offset = offset
+        raise StopIteration()
+
+
+def get_tokenizer(lang):
+    '''Return a tokenizer for ``lang`` that knows about LaTeX.'''
+    return enchant.tokenize.get_tokenizer(lang, chunkers=[LatexChunker],
+                                          filters=[LatexCommandFilter])
+
+
+def get_dictionary(lang, pwl=None, broker=None):
+    '''Return a dictionary for ``lang``, with personal word list ``pwl`` (a filename).'''
+    if pwl is not None:
+        return enchant.DictWithPWL(lang, pwl, broker=broker)
+    if broker is not None:
+        return broker.request_dict(lang)
+    return enchant.Dict(lang)
+
+
+def default_pwls(lang):
+    '''Return the files that enchant uses as personal word lists if no ``pwl`` is given.
+
+    These are ``<lang>.dic`` (words added with "a") and ``<lang>.exc``
+    (excluded words) in ``$ENCHANT_CONFIG_DIR`` or, if that is not set, in
+    the configuration directories of enchant 2 (``~/.config/enchant``) and
+    enchant 1 (``~/.enchant``).
+    '''
+    configdir = os.environ.get('ENCHANT_CONFIG_DIR')
+    if configdir:
+        dirs = [configdir]
+    else:
+        xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+        dirs = [os.path.join(xdg, 'enchant'), os.path.join(os.path.expanduser('~'), '.enchant')]
+    return [os.path.join(d, lang + ext) for d in dirs for ext in ('.dic', '.exc')]
+
+
+def dictionary_id(dictionary, pwl=None):
+    '''Describe dictionary and personal word list, so that changes can be detected.
+
+    Without ``pwl``, the default personal word lists (see ``default_pwls``)
+    are described instead.
+    '''
+    provider = getattr(dictionary, 'provider', None)
+    pwlhash = None
+    sha = hashlib.sha1()
+    for filename in [pwl] if pwl is not None else default_pwls(dictionary.tag):
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                sha.update(filename.encode('utf-8') + b'\0' + f.read() + b'\0')
+            pwlhash = sha.hexdigest()
+    return {'lang': dictionary.tag,
+            'provider': None if provider is None else [provider.name, provider.file],
+            'pwl': pwlhash}
+
+
+class CheckedCells(object):
+    '''Remember which cells of a notebook passed the spell check.
+
+    The hashes of all cells that passed are kept in a small JSON file
+    (the "sidecar") next to the notebook, together with a description of
+    the dictionary and the personal word list. On the next run, only cells
+    with a new hash need to be checked. If the dictionary or the personal
+    word list changed, all cells are checked again.
+
+    Parameters
+    ----------
+    filename : string
+        Name of the sidecar file.
+    dictid : dict
+        Description of the dictionary, see ``dictionary_id``.
+    '''
+    version = 1
+
+    def __init__(self, filename, dictid):
+        self.filename = filename
+        self.passed = set()
+        self.checked = set()
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (IOError, ValueError):
+            return
+        if (stored.get('version') == self.version) and (stored.get('dictionary') == dictid):
+            self.passed = set(stored['cells'])
+
+    @staticmethod
+    def cellhash(cell):
+        text = cell.cell_type + '\0' + ''.join(cell.source)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def __contains__(self, cell):
+        return self.cellhash(cell) in self.passed
+
+    def add(self, cell):
+        '''Record that ``cell`` (in its final form) passed the check.'''
+        self.checked.add(self.cellhash(cell))
+
+    def save(self, dictid):
+        '''Write all cells that passed in this run to the sidecar file.
+
+        ``dictid`` is the description of the dictionary at the end of the
+        run, i.e. including all words that were added during the run.
+        '''
+        with AtomicWriter(self.filename, encoding='utf-8') as f:
+            json.dump({'version': self.version, 'dictionary': dictid,
+                       'cells': sorted(self.checked)}, f, indent=1)
+
+
+class WordChecker(object):
+    '''Check words against a dictionary, looking up each distinct word only once.
+
+    Parameters
+    ----------
+    dictionary : ``enchant.Dict``
+    '''
+    def __init__(self, dictionary):
+        self.dict = dictionary
+        self.cache = {}
+
+    def check(self, word):
+        '''Return ``(ok, suggestions)`` for ``word``.'''
+        result = self.cache.get(word)
+        if result is None:
+            if self.dict.check(word):
+                result = (True, [])
+            else:
+                result = (False, self.dict.suggest(word))
+            self.cache[word] = result
+        return result
+
+
+def find_misspellings(cells, wordchecker, tokenizer):
+    '''Find all misspelled words in the text cells of a notebook.
+
+    Parameters
+    ----------
+    cells : iterable
+        Cells of the notebook
+    wordchecker : ``WordChecker``
+    tokenizer : callable
+        Tokenizer as returned by ``get_tokenizer``. It is given the text of
+        a whole cell at once.
+
+    Returns
+    -------
+    misspellings : list of dicts
+        One entry for each misspelled word with the number of the cell, line
+        and column (all starting at 0), the word and suggestions.
+    '''
+    misspellings = []
+    for i, cell in enumerate(cells):
+        if cell.cell_type not in TEXTCELLS:
+            continue
+        lines = cell.source
+        linestarts = [0]
+        for line in lines[:-1]:
+            linestarts.append(linestarts[-1] + len(line))
+        for word, pos in tokenizer(''.join(lines)):
+            ok, suggestions = wordchecker.check(word)
+            if not ok:
+                j = bisect.bisect_right(linestarts, pos) - 1
+                misspellings.append({'cell': i, 'line': j, 'column': pos - linestarts[j],
+                                     'word': word, 'suggestions': suggestions})
+    return misspellings
+
+
+class SuggestionPrefetcher(threading.Thread):
+    '''Find misspelled words ahead of the interactive session and prepare suggestions.
+
+    Looking up suggestions can take a noticeable time with large word lists.
+    This thread goes through ``texts`` in the background and stores the
+    suggestions for every misspelled word in ``suggestions``, so that they
+    are ready when the user gets to that word.
+    It uses its own dictionary, so that it does not interfere with the
+    dictionary of the interactive session.
+
+    Parameters
+    ----------
+    lang : string
+        Language of the dictionary.
+    texts : list of strings
+        Text in the order in which it will be checked.
+    pwl : string or None
+        Filename of personal word list.
+    '''
+    def __init__(self, lang, texts, pwl=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lang = lang
+        self.pwl = pwl
+        self.texts = texts
+        self.tokenizer = get_tokenizer(lang)
+        self.suggestions = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        wordchecker = WordChecker(get_dictionary(self.lang, self.pwl, broker=enchant.Broker()))
+        for text in self.texts:
+            if self.stopped.is_set():
+                return
+            for word, pos in self.tokenizer(text):
+                ok, suggestions = wordchecker.check(word)
+                if not ok:
+                    self.suggestions[word] = suggestions
+
+    def stop(self):
+        self.stopped.set()
+
+
+class PrefetchingSpellChecker(enchant.checker.SpellChecker):
+    '''SpellChecker that uses prefetched suggestions and remembers corrections.
+
+    Every replacement the user makes is also applied to all later instances
+    of the same word, without asking again.
+
+    Parameters
+    ----------
+    lang : string
+        Language of the dictionary.
+    prefetcher : ``SuggestionPrefetcher`` or None
+        Suggestions are taken from here if they are ready.
+    '''
+    def __init__(self, lang, prefetcher=None, **kwargs):
+        enchant.checker.SpellChecker.__init__(self, lang, **kwargs)
+        self.prefetcher = prefetcher
+
+    def suggest(self, word=None):
+        if word is None:
+            word = self.word
+        if self.prefetcher is not None:
+            suggestions = self.prefetcher.suggestions.get(word)
+            if suggestions is not None:
+                return list(suggestions)
+        return enchant.checker.SpellChecker.suggest(self, word)
+
+    def replace(self, repl):
+        repl = self.coerce_string(repl)
+        self._replace_words[self.word] = repl
+        end = self.wordpos + len(repl)
+        enchant.checker.SpellChecker.replace(self, repl)
+        # pyenchant moves the tokenizer relative to its offset, which is the
+        # end of the current chunk for ``LatexChunker``, so the rest of the
+        # chunk would be skipped. Continue right after the replacement instead.
+        self._tokens.set_offset(end, replaced=True)
+
+
+class QuittingCmdLineChecker(CmdLineChecker):
+    '''CmdLineChecker that remembers if the user quit with "q".
+
+    ``run`` returns after "q" just as it does at the end of the text, so
+    ``quit`` tells the two apart. Once set, it stays ``True``.
+
+    Parameters
+    ----------
+    checker : ``enchant.checker.SpellChecker``
+    '''
+    quit = False
+
+    def __init__(self, checker):
+        try:
+            CmdLineChecker.__init__(self, checker)
+        except TypeError:
+            # Older versions of pyenchant take the checker in ``set_checker``
+            CmdLineChecker.__init__(self)
+            self.set_checker(checker)
+
+    def read_command(self):
+        status = CmdLineChecker.read_command(self)
+        # "q" is the only command that stops the loop in ``run``
+        if self._stop:
+            self.quit = True
+        return status
+
+
+# WordChecker and tokenizer of each worker process in check_notebooks
+_worker = None
+
+
+def _init_worker(lang, pwl):
+    global _worker
+    _worker = (WordChecker(get_dictionary(lang, pwl)), get_tokenizer(lang))
+
+
+def _check_notebook(filename):
+    with open(filename, 'rb') as f:
+        cells = NotebookReader(f, needs_outputs=lambda cell: False)
+        return find_misspellings(cells, *_worker)
+
+
+def check_notebooks(filenames, lang=LANGUAGE, pwl=None, workers=None):
+    '''Spell check many notebooks without asking the user anything.
+
+    Notebooks are checked in parallel in ``workers`` processes (default: one
+    per CPU core).
+
+    Returns
+    -------
+    report : list of dicts
+        One entry per misspelled word, see ``find_misspellings``, with the
+        filename of the notebook added.
+    '''
+    report = []
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(lang, pwl)) as executor:
+        for filename, misspellings in zip(filenames, executor.map(_check_notebook, filenames)):
+            for m in misspellings:
+                m['notebook'] = filename
+                report.append(m)
+    return report
+
+
+def write_report(report, outfile, format=None):
+    '''Write spell check report as JSON or CSV file.
+
+    Parameters
+    ----------
+    report : list of dicts
+        see ``check_notebooks``
+    outfile : string
+        Filename (``'-'`` for stdout).
+    format : 'json', 'csv' or None
+        If ``None``, CSV is used for files ending in ``.csv`` and JSON otherwise.
+    '''
+    if format is None:
+        format = 'csv' if outfile.lower().endswith('.csv') else 'json'
+    out = sys.stdout if outfile == '-' else open(outfile, 'w', encoding='utf-8', newline='')
+    try:
+        if format == 'json':
+            json.dump(report, out, indent=1, ensure_ascii=False)
+            out.write('\n')
+        else:
+            columns = ['notebook', 'cell', 'line', 'column', 'word', 'suggestions']
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for m in report:
+                writer.writerow([m[c] if c != 'suggestions' else ' '.join(m[c]) for c in columns])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def _check_on_server(path, filenames, pwl):
+    '''Get report from a server, or ``None`` if no server is running.'''
+    names = dict((os.path.abspath(f), f) for f in filenames)
+    try:
+        report = client.request('check', path=path, files=list(names), lang=LANGUAGE,
+                                pwl=None if pwl is None else os.path.abspath(pwl))
+    except OSError as e:
+        print('No server at {0} ({1}), checking here.'.format(path or 'the default socket', e),
+              file=sys.stderr)
+        return None
+    for m in report:
+        m['notebook'] = names[m['notebook']]
+    return report
+
+
 def jupyterspellchecker():
     parser = argparse.ArgumentParser(description='''Spell check a Jupyter/IPython notebook to a LaTeX file.
 
 Raw cells and markdown cells are spell checked in American English.
 ''')
-    parser.add_argument('infile', help='path and filename of the input notebook file.')
-    parser.add_argument('outfile', help='path and filename of the output file.')
+    parser.add_argument('files', nargs='+', metavar='file',
+                        help='path and filename of the input notebook file and of the output file. With --report: any number of input notebook files.')
+    parser.add_argument('--report',
+                        help='Do not ask about each word, but write all misspelled words into this file (JSON or, if the filename ends in .csv, CSV; "-" for stdout). Exits with status 1 if there are misspelled words.')
+    parser.add_argument('--pwl',
+                        help='File with a personal word list (one word per line). Words that are added during the spell check are stored there.')
+    parser.add_argument('--sidecar',
+                        help='File that records which cells passed the spell check, so that they are not checked again (default: output file name + ".spellcheck.json").')
+    parser.add_argument('--recheck', action='store_true',
+                        help='Check all cells, even if they passed before.')
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes to check notebooks in parallel with --report (default: number of CPU cores).')
+    parser.add_argument('--server', nargs='?', const=None, default=False, metavar='SOCKET',
+                        help='With --report: let a running ipythontools-server check the notebooks (default socket: ipythontools-<uid>.sock in $XDG_RUNTIME_DIR or the temporary directory). If there is no server, check here.')
     args = parser.parse_args()
 
-    chkr = enchant.checker.SpellChecker("en_US", filters=[LatexCommandFilter])
-    cmdln = CmdLineChecker()
-    cmdln.set_checker(chkr)
+    if args.report is not None:
+        report = None
+        if args.server is not False:
+            report = _check_on_server(args.server, args.files, args.pwl)
+        if report is None:
+            report = check_notebooks(args.files, pwl=args.pwl, workers=args.workers)
+        write_report(report, args.report)
+        print('{0} misspelled words in {1} notebooks'.format(len(report), len(args.files)),
+              file=sys.stderr)
+        sys.exit(1 if len(report) > 0 else 0)
+
+    if len(args.files) != 2:
+        parser.error('Give exactly one input and one output file (or use --report).')
+    infile, outfile = args.files
+
+    with open(infile, 'rb') as f:
+        print('Parsing ', infile)
+        # Outputs are never spell checked. Remember where the sources are,
+        # so that corrections can be written back without rewriting the rest.
+        reader = NotebookReader(f, needs_outputs=lambda cell: False, record_sources=True)
+        cells = list(reader)
+
+    dictionary = get_dictionary(LANGUAGE, args.pwl)
+    sidecar = args.sidecar if args.sidecar is not None else outfile + '.spellcheck.json'
+    checkedcells = CheckedCells(sidecar, dictionary_id(dictionary, args.pwl))
+    if args.recheck:
+        checkedcells.passed = set()
+    tocheck = [cell for cell in cells if (cell.cell_type in TEXTCELLS) and (cell not in checkedcells)]
+    print('Checking {0} cells ({1} unchanged since the last check)'.format(
+        len(tocheck), len([c for c in cells if c.cell_type in TEXTCELLS]) - len(tocheck)))
+
+    # Start looking up suggestions for misspelled words in the background.
+    texts = [''.join(cell.source) for cell in tocheck]
+    prefetcher = SuggestionPrefetcher(LANGUAGE, texts, pwl=args.pwl)
+    prefetcher.start()
 
+    chkr = PrefetchingSpellChecker(dictionary, prefetcher=prefetcher, chunkers=[LatexChunker],
+                                   filters=[LatexCommandFilter])
+    cmdln = QuittingCmdLineChecker(chkr)
 
-    with open(args.infile, 'r') as f:
-        print('Parsing ', args.infile)
-        ipynb = json.load(f)
+    patches = []
+    stopped = False
+    unchecked = 0
+    for cell, span in zip(cells, reader.source_spans):
+        if cell.cell_type not in TEXTCELLS:
+            continue
+        if cell in checkedcells:
+            checkedcells.add(cell)
+            continue
+        if stopped:
+            unchecked += 1
+            continue
+        # Check the whole cell at once, so that math and references can span lines
+        text = ''.join(cell.source)
+        chkr.set_text(text)
+        cmdln.run()
+        newtext = chkr.get_text()
+        if newtext != text:
+            source = newtext.splitlines(True)
+            patches.extend(source_patches(span, cell.source, source))
+            cell.source = source
+        # "q" only ends ``run`` for the current cell. Corrections made so far
+        # are kept, but the cell did not pass and the session ends here.
+        if cmdln.quit:
+            stopped = True
+            unchecked += 1
+        else:
+            checkedcells.add(cell)
+    prefetcher.stop()
+    if stopped:
+        print('Stopped, {0} cells were not checked completely.'.format(unchecked))
+    checkedcells.save(dictionary_id(dictionary, args.pwl))
 
-    if 'cells' in ipynb:
-        # newer versions of notebook
-        cells = ipynb['cells']
+    if patches or not os.path.exists(outfile) or not os.path.samefile(infile, outfile):
+        print('Writing ', outfile)
+        splice(infile, outfile, patches)
     else:
-        # notebook format 1
-        cells = ipynb['worksheets'][0]['cells']
-
-    for cell in cells:
-        if cell['cell_type'] in ['markdown', 'raw', 'heading']:
-            for i, line in enumerate(cell['source']):
-                chkr.set_text(line)
-                cmdln.run()
-                cell['source'][i] = chkr.get_text()
-
-    with open(args.outfile, 'w') as f:
-        print('Writing ', args.outfile)
-        json.dump(ipynb, f)
+        print('No changes in ', outfile)
     sys.exit()
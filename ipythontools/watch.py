@@ -0,0 +1,121 @@
+'''Wait for files to change
+
+``changes`` yields every time one of a list of files is written to disk.
+On Linux it uses inotify (through ``ctypes``, so no external dependencies)
+and reacts immediately; everywhere else it falls back to checking the
+modification time of the files every ``interval`` seconds.
+
+Directories are watched instead of the files themselves, because editors
+and the Jupyter server usually save a file by writing a new file and
+renaming it, which would end an inotify watch on the old file.
+'''
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct('iIII')
+
+
+class _Inotify(object):
+    def __init__(self, filenames):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.names = {}
+        for filename in filenames:
+            dirname, basename = os.path.split(os.path.abspath(filename))
+            wd = libc.inotify_add_watch(self.fd, dirname.encode(sys.getfilesystemencoding()),
+                                        IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for ' + dirname)
+            self.names.setdefault(wd, {})[basename.encode(sys.getfilesystemencoding())] = filename
+
+    def _read(self):
+        changed = set()
+        data = os.read(self.fd, 2**16)
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            if name in self.names.get(wd, {}):
+                changed.add(self.names[wd][name])
+        return changed
+
+    def changes(self, delay):
+        while True:
+            try:
+                select.select([self.fd], [], [])
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            changed = self._read()
+            # Saving often involves several events. Collect them all.
+            while select.select([self.fd], [], [], delay)[0]:
+                changed |= self._read()
+            if changed:
+                yield changed
+
+
+def _stat(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class _Poll(object):
+    def __init__(self, filenames):
+        self.filenames = filenames
+        self.state = dict((f, _stat(f)) for f in filenames)
+
+    def changes(self, interval):
+        while True:
+            time.sleep(interval)
+            changed = set()
+            for f in self.filenames:
+                new = _stat(f)
+                if new != self.state[f]:
+                    self.state[f] = new
+                    changed.add(f)
+            if changed:
+                yield changed
+
+
+def changes(filenames, interval=1., delay=0.1):
+    '''Yield a set of filenames each time some of ``filenames`` change.
+
+    Files are watched from the moment this function is called, so changes
+    that happen while the caller is busy with the last change are not lost.
+
+    Parameters
+    ----------
+    filenames : list of strings
+        Files to watch.
+    interval : float
+        Polling interval in seconds, if inotify is not available.
+    delay : float
+        With inotify, wait for this many seconds after a change for more
+        events to collect them into a single change.
+    '''
+    filenames = list(filenames)
+    try:
+        watcher = _Inotify(filenames)
+    except (OSError, AttributeError):
+        # Not Linux or no more inotify watches available
+        return _Poll(filenames).changes(interval)
+    return watcher.changes(delay)
@@ -31,6 +31,8 @@ setup(
         'console_scripts': [
             'jupyter2article = ipythontools.jupyter2article:jupyter2article',
             'jupyterspellcheck = ipythontools.spellchecker:jupyterspellchecker',
+            'ipythontools-server = ipythontools.server:main',
+            'ipythontools-build = ipythontools.build:main',
             ]
         }
 )
@@ -0,0 +1,100 @@
+import json
+import os
+
+from ipythontools.build import ProjectBuilder
+
+
+def notebook(filename, sources):
+    cells = [{'cell_type': 'raw', 'metadata': {}, 'source': source} for source in sources]
+    filename.write_text(json.dumps({'cells': cells, 'metadata': {},
+                                    'nbformat': 4, 'nbformat_minor': 4}))
+
+
+def project(tmp_path):
+    notebook(tmp_path / 'ch1.ipynb', ['one', 'two', 'three'])
+    notebook(tmp_path / 'ch2.ipynb', ['four'])
+    (tmp_path / 'paper.json').write_text(json.dumps({
+        'main': {'outfile': 'paper.tex'},
+        'targets': [{'infile': 'ch1.ipynb', 'outfile': 'a.tex', 'stop': 1},
+                    {'infile': 'ch1.ipynb', 'outfile': 'b.tex', 'start': 1},
+                    {'infile': 'ch2.ipynb', 'outfile': 'c.tex'}]}))
+    return str(tmp_path / 'paper.json')
+
+
+def build(manifest):
+    builder = ProjectBuilder(manifest)
+    with open(os.devnull, 'w') as log:
+        results = builder.build(workers=1, backend='thread', log=log)
+    return builder, results
+
+
+def stale(manifest):
+    return sorted(os.path.basename(t['outfile']) for t in ProjectBuilder(manifest).stale())
+
+
+def test_build_and_staleness(tmp_path):
+    manifest = project(tmp_path)
+    assert stale(manifest) == ['a.tex', 'b.tex', 'c.tex']
+    builder, results = build(manifest)
+    # Targets from the same notebook are converted together
+    assert len(results) == 2
+    assert all(r.error is None for r in results)
+    assert (tmp_path / 'a.tex').read_text() == 'one\n'
+    assert (tmp_path / 'b.tex').read_text() == 'two\nthree\n'
+    assert (tmp_path / 'paper.tex').read_text() == '\\input{a}\n\\input{b}\n\\input{c}\n'
+    assert stale(manifest) == []
+
+    notebook(tmp_path / 'ch2.ipynb', ['four', 'five'])
+    assert stale(manifest) == ['c.tex']
+    (tmp_path / 'a.tex').unlink()
+    assert stale(manifest) == ['a.tex', 'c.tex']
+    builder, results = build(manifest)
+    assert [r.job['infile'] for r in results] == [str(tmp_path / 'ch1.ipynb'),
+                                                  str(tmp_path / 'ch2.ipynb')]
+    assert stale(manifest) == []
+
+
+def test_recorded_hashes(tmp_path):
+    manifest = project(tmp_path)
+    builder, results = build(manifest)
+    state = json.loads((tmp_path / 'paper.build.json').read_text())
+    record = state['targets'][str(tmp_path / 'c.tex')]
+    assert record['output'] == builder.state.filehash(str(tmp_path / 'c.tex'))
+    assert record['inputs'] == {str(tmp_path / 'ch2.ipynb'):
+                                builder.state.filehash(str(tmp_path / 'ch2.ipynb'))}
+
+
+def test_notebook_saved_during_build(tmp_path):
+    manifest = project(tmp_path)
+    builder = ProjectBuilder(manifest)
+    convert_many = builder.converter.convert_many
+
+    def save_during_build(jobs, **kwargs):
+        results = convert_many(jobs, **kwargs)
+        notebook(tmp_path / 'ch2.ipynb', ['changed while converting'])
+        return results
+
+    builder.converter.convert_many = save_during_build
+    with open(os.devnull, 'w') as log:
+        builder.build(workers=1, backend='thread', log=log)
+    assert stale(manifest) == ['c.tex']
+
+
+def test_crossref_across_notebooks(tmp_path):
+    manifest = project(tmp_path)
+    notebook(tmp_path / 'ch1.ipynb', ['\\label{eq:one}', 'see \\ref{eq:four}', '\\label{eq:x}'])
+    notebook(tmp_path / 'ch2.ipynb', ['\\label{eq:four} \\label{eq:x} \\ref{eq:y}'])
+    builder = ProjectBuilder(manifest)
+    with open(os.devnull, 'w') as log:
+        builder.build(workers=1, backend='thread', log=log)
+    messages = builder.crossref().messages()
+    assert len(messages) == 2
+    assert 'Label eq:x is defined more than once' in messages[0]
+    assert 'Reference to undefined label eq:y' in messages[1]
+
+    # The index of a notebook that is up to date comes from the state file
+    notebook(tmp_path / 'ch2.ipynb', ['\\label{eq:four} \\label{eq:y}'])
+    builder = ProjectBuilder(manifest)
+    with open(os.devnull, 'w') as log:
+        assert len(builder.build(workers=1, backend='thread', log=log)) == 1
+    assert builder.crossref().messages() == []
@@ -0,0 +1,83 @@
+import io
+import json
+
+from ipythontools.crossref import CrossrefIndex
+from ipythontools.jupyter2article import NotebookConverter
+
+
+def notebook(tmp_path, cells, name='nb.ipynb'):
+    cells = [{'cell_type': cell_type, 'metadata': {}, 'source': source}
+             for cell_type, source in cells]
+    filename = tmp_path / name
+    filename.write_text(json.dumps({'cells': cells, 'metadata': {},
+                                    'nbformat': 4, 'nbformat_minor': 4}))
+    return str(filename)
+
+
+def convert(tmp_path, infile, ranges, **kwargs):
+    '''Convert ``ranges`` (start, stop) and return the crossref JSON and the log.'''
+    log = io.StringIO()
+    crossref = tmp_path / 'crossref.json'
+    ranges = [(start, stop, str(tmp_path / '{0}.tex'.format(i)))
+              for i, (start, stop) in enumerate(ranges)]
+    NotebookConverter().convert_ranges(infile, ranges, crossref=str(crossref), log=log, **kwargs)
+    return json.loads(crossref.read_text()), log.getvalue()
+
+
+def problems(index):
+    return [(p['problem'], p['key'], p['cells']) for p in index.problems()]
+
+
+def test_renamed_headings(tmp_path):
+    infile = notebook(tmp_path, [('markdown', '# Results'), ('markdown', '# Results'),
+                                 ('markdown', '# Results\nSee \\ref{sect:results-2}.')])
+    index, log = convert(tmp_path, infile, [(0, 3)])
+    text = (tmp_path / '0.tex').read_text()
+    assert '\\label{sect:results}' in text
+    assert '\\label{sect:results-2}' in text
+    assert '\\label{sect:results-3}' in text
+    assert 'Label sect:results is already used, so the heading in cell 1' in log
+    assert [(p['problem'], p['newkey'], p['cells']) for p in index['problems']] == \
+        [('renamed label', 'sect:results-2', [1]), ('renamed label', 'sect:results-3', [2])]
+
+
+def test_duplicate_and_undefined(tmp_path):
+    index = CrossrefIndex()
+    index._scan(0, '\\label{eq:a} \\label{eq:a} \\ref{eq:a}')
+    index._scan(3, '\\eqref{eq:b} and \\autoref{eq:b, eq:a} \\cite{x}')
+    assert problems(index) == [('duplicate label', 'eq:a', [0, 0]),
+                               ('undefined reference', 'eq:b', [3])]
+    assert index.messages()[1] == 'Warning: <stream>: Reference to undefined label eq:b (cell 3).'
+    assert [p['key'] for p in index.problems(bibkeys={'y'})][-1] == 'x'
+
+
+def test_labels_in_other_ranges_and_templates(tmp_path):
+    infile = notebook(tmp_path, [('raw', 'see \\ref{eq:later} and \\ref{tab:template}'),
+                                 ('raw', '% \\label{eq:commented}'),
+                                 ('raw', '\\label{eq:later}')])
+    before = tmp_path / 'before.tex'
+    before.write_text('\\label{tab:template} \\ref{eq:commented}')
+    index, log = convert(tmp_path, infile, [(0, 1), (1, 3)], file_before=str(before))
+    assert index['templates'] == [str(before)]
+    assert index['labels']['tab:template'] == [str(before)]
+    assert [(p['problem'], p['key'], p['cells']) for p in index['problems']] == \
+        [('undefined reference', 'eq:commented', [str(before)])]
+    assert 'eq:later' not in log
+    index, log = convert(tmp_path, infile, [(0, 3)], warn=False)
+    assert 'tab:template' in [p['key'] for p in index['problems']]
+    assert 'Warning' not in log
+
+
+def test_combine(tmp_path):
+    one, two = CrossrefIndex('one.ipynb'), CrossrefIndex('two.ipynb')
+    one._scan(1, '\\label{eq:a} \\ref{eq:b}')
+    two._scan(2, '\\label{eq:b} \\label{eq:a}')
+    for index in (one, two):
+        index.add_template('before.tex', '\\label{tab:x} \\ref{eq:c}')
+    combined = CrossrefIndex.combine([one, json.loads(json.dumps(two.as_dict()))], name='paper')
+    # The template is shared, so its label is not a duplicate
+    assert problems(combined) == [
+        ('duplicate label', 'eq:a', ['one.ipynb cell 1', 'two.ipynb cell 2']),
+        ('undefined reference', 'eq:c', ['before.tex'])]
+    assert combined.messages()[0] == ('Warning: paper: Label eq:a is defined more than once '
+                                      '(one.ipynb cell 1, two.ipynb cell 2).')
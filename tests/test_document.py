@@ -0,0 +1,37 @@
+import pytest
+
+from ipythontools.document import (Heading, Paragraph, LatexBlock, CodeOutput, BlankLines,
+                                   TextEmitter, MarkdownEmitter, as_nodes, get_emitter)
+
+NODES = [Heading(1, 'Results', 'sect:results', 'section'),
+         BlankLines(1),
+         Paragraph(['The \\emph{flux} is $F = 1$~\\citep{ref} (see Fig.~\\ref{fig:a}).\n',
+                    '% not in the text\n']),
+         LatexBlock(['\\begin{figure}\n', '\\includegraphics[width=5cm]{a.png}\n',
+                     '\\caption{The spectrum.\\label{fig:a}}\n', '\\end{figure}\n']),
+         CodeOutput(['a   b\n', '1   2\n']),
+         BlankLines(2)]
+
+
+def test_text_emitter():
+    assert TextEmitter().emit(NODES) == ('Results\n\nThe flux is  (see Fig.).\n\n'
+                                         '\n\nThe spectrum.\n\n\n\n')
+
+
+def test_markdown_emitter():
+    assert MarkdownEmitter().emit(NODES) == (
+        '# Results\n\n'
+        'The \\emph{flux} is $F = 1$~\\citep{ref} (see Fig.~\\ref{fig:a}).\n% not in the text\n'
+        '```latex\n\\begin{figure}\n\\includegraphics[width=5cm]{a.png}\n'
+        '\\caption{The spectrum.\\label{fig:a}}\n\\end{figure}\n```\n'
+        '```\na   b\n1   2\n```\n\n\n')
+    assert MarkdownEmitter().emit([CodeOutput(['  \n'])]) == ''
+
+
+def test_as_nodes_and_get_emitter():
+    assert as_nodes('x') == [LatexBlock(['x'])]
+    assert as_nodes(['a', 'b', BlankLines(1), 'c']) == [LatexBlock(['a', 'b']), BlankLines(1),
+                                                          LatexBlock(['c'])]
+    assert isinstance(get_emitter('text'), TextEmitter)
+    with pytest.raises(ValueError, match='Unknown output format'):
+        get_emitter('html')
@@ -0,0 +1,191 @@
+import io
+import os
+import bz2
+import gzip
+import json
+import lzma
+
+import pytest
+
+from ipythontools.jupyter2article import NotebookConverter, _cellarg
+from ipythontools.cache import ConversionCache
+from ipythontools.profiling import ConversionProfile
+
+
+def notebook(tmp_path, sources):
+    '''Write a notebook with a raw cell for each string in ``sources`` (dicts are cells).'''
+    cells = [source if isinstance(source, dict) else
+             {'cell_type': 'raw', 'metadata': {}, 'source': source} for source in sources]
+    filename = tmp_path / 'nb.ipynb'
+    filename.write_text(json.dumps({'cells': cells, 'metadata': {},
+                                    'nbformat': 4, 'nbformat_minor': 4}))
+    return str(filename)
+
+
+def test_cellarg():
+    assert _cellarg('12') == 12
+    assert _cellarg('# Appendix') == '# Appendix'
+
+
+def test_numbered_range(tmp_path):
+    infile = notebook(tmp_path, ['a', 'b', 'c', 'd'])
+    converter = NotebookConverter()
+    assert converter.convert_to_string(infile, start=1, stop=3) == 'b\nc\n'
+    assert converter.convert_to_string(infile, start=4) == ''
+
+
+def test_start_after_end(tmp_path):
+    infile = notebook(tmp_path, ['a', 'b', 'c'])
+    converter = NotebookConverter()
+    with pytest.raises(Exception, match='Start cell found after end cell'):
+        converter.convert_to_string(infile, start=5)
+    with pytest.raises(Exception, match='Start cell found after end cell'):
+        converter.convert_to_string(infile, start=2, stop=1)
+
+
+def codecell(outputs, source=('# output->LaTeX\n', 'x')):
+    return {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'source': list(source),
+            'outputs': outputs}
+
+
+def test_output_selection(tmp_path):
+    infile = notebook(tmp_path, [
+        codecell([{'output_type': 'stream', 'name': 'stdout', 'text': ['printed\n']},
+                  {'output_type': 'display_data', 'metadata': {},
+                   'data': {'text/plain': ['<Figure>'], 'image/png': 'iVBORw0KGgo='}},
+                  {'output_type': 'display_data', 'metadata': {},
+                   'data': {'text/plain': ['<Latex>'], 'text/latex': ['$x$']}},
+                  {'output_type': 'execute_result', 'execution_count': 1, 'metadata': {},
+                   'data': {'text/plain': ['<Table>'], 'text/latex': ['\\begin{tabular}']}}]),
+        codecell([{'output_type': 'execute_result', 'execution_count': 1, 'metadata': {},
+                   'data': {'text/plain': ['42']}}]),
+        codecell([{'output_type': 'stream', 'name': 'stdout', 'text': ['not marked\n']}],
+                 source=['print(1)'])])
+    assert NotebookConverter().convert_to_string(infile) == \
+        'printed\n$x$\n\\begin{tabular}\n\n42\n\n'
+
+
+def test_spill_size(tmp_path):
+    table = ['row {0}\n'.format(i) for i in range(100)]
+    infile = notebook(tmp_path, ['a', codecell([{'output_type': 'stream', 'name': 'stdout',
+                                                  'text': table}])])
+    outfile = tmp_path / 'paper.tex'
+    converter = NotebookConverter(spill_size=100)
+    converter.convert_ranges(infile, [(0, 2, str(outfile))], log=io.StringIO())
+    spilled = sorted(tmp_path.glob('paper-output-*.tex'))
+    assert len(spilled) == 1
+    assert spilled[0].read_text() == ''.join(table)
+    assert outfile.read_text() == 'a\n\\input{{{0}}}\n\n'.format(spilled[0].stem)
+
+    # Small outputs stay in the file, and unused spilled files are removed
+    converter.convert_ranges(infile, [(0, 2, str(outfile))], log=io.StringIO(),
+                             spill_size=10000)
+    assert list(tmp_path.glob('paper-output-*.tex')) == []
+    assert outfile.read_text() == 'a\n' + ''.join(table) + '\n'
+
+
+def test_spilled_files_only_written_with_outfile(tmp_path):
+    table = ['row {0}\n'.format(i) for i in range(100)]
+    infile = notebook(tmp_path, [codecell([{'output_type': 'stream', 'name': 'stdout',
+                                             'text': table}])])
+    outfile = tmp_path / 'paper.tex'
+    with pytest.raises(Exception, match='Start cell found after end cell'):
+        NotebookConverter(spill_size=100).convert_ranges(infile, [(0, 1, str(outfile)),
+                                                                  (5, 6, str(tmp_path / 'b.tex'))],
+                                                         log=io.StringIO())
+    assert os.listdir(str(tmp_path)) == ['nb.ipynb']
+
+
+def test_cache_hits_and_misses(tmp_path):
+    output = {'output_type': 'execute_result', 'execution_count': 1, 'metadata': {},
+              'data': {'text/plain': ['42'], 'image/png': 'iVBORw0KGgo='}}
+    infile = notebook(tmp_path, ['a', 'b', codecell([output])])
+    cachefile = str(tmp_path / 'cache.json')
+    converter = NotebookConverter(cache=ConversionCache(cachefile))
+    text = converter.convert_to_string(infile)
+    assert (converter.cache.hits, converter.cache.misses) == (0, 3)
+    converter.cache.save()
+
+    # Running the notebook again changes counts and metadata, but not the output
+    output = dict(output, execution_count=7, metadata={'isolated': True})
+    infile = notebook(tmp_path, ['a', 'changed', codecell([output])])
+    converter = NotebookConverter(cache=ConversionCache(cachefile))
+    assert converter.convert_to_string(infile) == text.replace('b', 'changed')
+    assert (converter.cache.hits, converter.cache.misses) == (2, 1)
+
+
+def test_cache_evicts_least_recently_used():
+    nodes = [['Paragraph', ['x' * 50]]]
+    cache = ConversionCache()
+    cache.set('a', nodes)
+    # Room for three entries
+    cache.maxsize = 3 * cache.size
+    for key in 'bc':
+        cache.set(key, nodes)
+    assert cache.get('a') == nodes
+    cache.set('d', nodes)
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.get('b') is None
+    assert cache.size <= cache.maxsize
+
+
+@pytest.mark.parametrize('content', ['{"version": 5, "entr', '[1, 2]', '{"version": 5}',
+                                     '{"version": 5, "entries": [["k", [["Unknown"]]]]}',
+                                     '{"version": 5, "entries": [1]}', '\xff\xfe'])
+def test_corrupt_cache_file(tmp_path, content):
+    cachefile = tmp_path / 'cache.json'
+    cachefile.write_bytes(content.encode('latin-1'))
+    cache = ConversionCache(str(cachefile))
+    assert len(cache.entries) == 0
+    infile = notebook(tmp_path, ['a'])
+    assert NotebookConverter(cache=cache).convert_to_string(infile) == 'a\n'
+    cache.save()
+    assert len(ConversionCache(str(cachefile)).entries) == 1
+
+
+def test_profile_counts_latex_output_once(tmp_path):
+    infile = notebook(tmp_path, ['caf\u00e9', '# Title'])
+    profile = ConversionProfile()
+    converter = NotebookConverter(profile=profile)
+    converter.convert_ranges(infile, [(0, 2, str(tmp_path / 'a.tex')),
+                                      (0, 2, str(tmp_path / 'a.txt'), 'text'),
+                                      (0, 2, str(tmp_path / 'a.md'), 'markdown')], log=io.StringIO())
+    assert profile.celltypes['raw']['bytes_out'] == len((tmp_path / 'a.tex').read_bytes())
+    profile.write(str(tmp_path / 'profile.txt'))
+    profile.write(str(tmp_path / 'profile.json'))
+    assert json.loads((tmp_path / 'profile.json').read_text(encoding='utf-8'))['celltypes']
+
+
+class Pipe(io.RawIOBase):
+    '''Bytes that can only be read from start to end, like stdin.'''
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.data.readinto(b)
+
+
+@pytest.mark.parametrize('suffix, compress', [('.gz', gzip.compress), ('.xz', lzma.compress),
+                                              ('.bz2', bz2.compress)])
+def test_compressed_input(tmp_path, suffix, compress):
+    table = codecell([{'output_type': 'stream', 'name': 'stdout', 'text': ['a & b \\\\\n']}])
+    infile = notebook(tmp_path, ['# Title', 'caf\u00e9', table])
+    expected = NotebookConverter().convert_to_string(infile)
+    with open(infile, 'rb') as f:
+        data = compress(f.read())
+    compressed = tmp_path / ('nb.ipynb' + suffix)
+    compressed.write_bytes(data)
+    converter = NotebookConverter()
+    assert converter.convert_to_string(str(compressed)) == expected
+    assert converter.convert_to_string(str(compressed), start='caf\u00e9') == \
+        NotebookConverter().convert_to_string(infile, start='caf\u00e9')
+    outfile = tmp_path / 'out.tex'
+    converter.convert(str(compressed), str(outfile))
+    assert outfile.read_text(encoding='utf-8') == expected
+    # Also from a stream that cannot seek, e.g. stdin
+    out = io.StringIO()
+    converter.convert_stream(io.BufferedReader(Pipe(data)), out)
+    assert out.getvalue() == expected
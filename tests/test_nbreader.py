@@ -0,0 +1,100 @@
+import io
+import json
+
+import pytest
+
+from ipythontools.nbreader import NotebookReader, _JSONScanner
+
+CHUNKSIZES = [1, 2, 3, 7, 2**16]
+
+TEXT = ['Escapes: "quoted" back\\slash\ttab /slash\n',
+        'Non-ASCII: été 日本 \U0001f600 ü\n',
+        'Control: \x01 and {braces} [brackets], commas']
+
+V4 = {'cells': [
+    {'cell_type': 'markdown', 'metadata': {'tags': ['a', 'b']}, 'source': TEXT},
+    {'cell_type': 'raw', 'metadata': {}, 'source': ''.join(TEXT)},
+    {'cell_type': 'code', 'execution_count': 3, 'metadata': {'x': {'y': [1, 2.5e-3, None, True]}},
+     'source': ['# output->LaTeX\n', 'print("é")'],
+     'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': TEXT},
+                 {'output_type': 'execute_result', 'execution_count': 3, 'metadata': {},
+                  'data': {'text/plain': ['<Table>'], 'text/latex': TEXT,
+                           'image/png': 'iVBORw0KGgo='}}]},
+    {'cell_type': 'code', 'execution_count': None, 'metadata': {}, 'source': [], 'outputs': []}],
+    'metadata': {'kernelspec': {'name': 'python3'}}, 'nbformat': 4, 'nbformat_minor': 4}
+
+V3 = {'worksheets': [{'cells': [
+    {'cell_type': 'heading', 'level': 2, 'metadata': {}, 'source': ['Title é']},
+    {'cell_type': 'markdown', 'metadata': {}, 'source': TEXT},
+    {'cell_type': 'code', 'collapsed': False, 'language': 'python', 'metadata': {},
+     'input': ['# output->LaTeX\n', 'x'], 'prompt_number': 7,
+     'outputs': [{'output_type': 'pyout', 'prompt_number': 7, 'metadata': {},
+                  'text': TEXT, 'latex': ['$x$'], 'png': 'iVBORw0KGgo='}]}]}],
+    'metadata': {'name': ''}, 'nbformat': 3, 'nbformat_minor': 0}
+
+
+def dumps(nb, ensure_ascii, indent):
+    return json.dumps(nb, ensure_ascii=ensure_ascii, indent=indent).encode('utf-8')
+
+
+def expected_outputs(outputs):
+    '''Outputs as ``NotebookReader`` returns them, i.e. without images.'''
+    expected = []
+    for out in outputs:
+        out = dict((k, v) for k, v in out.items() if k in NotebookReader.output_keys)
+        if 'data' in out:
+            out['data'] = dict((k, v) for k, v in out['data'].items()
+                               if k in NotebookReader.output_mimetypes)
+        expected.append(out)
+    return expected
+
+
+@pytest.mark.parametrize('chunksize', CHUNKSIZES)
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+def test_scanner_read_value(chunksize, ensure_ascii):
+    data = dumps(V4, ensure_ascii, 1)
+    scanner = _JSONScanner(io.BytesIO(data), chunksize=chunksize)
+    assert scanner.read_value() == json.loads(data.decode('utf-8'))
+    assert scanner.tell() == len(data)
+
+
+@pytest.mark.parametrize('chunksize', CHUNKSIZES)
+def test_scanner_skip_value(chunksize):
+    data = b'[ "a\\"]" , {"b": [1, -2.5e+3, true, false, null, "\\\\"]}, 17]'
+    scanner = _JSONScanner(io.BytesIO(data), chunksize=chunksize)
+    values = []
+    for i in scanner.iter_array():
+        if i == 1:
+            scanner.skip_value()
+        else:
+            values.append(scanner.read_value())
+    assert values == ['a"]', 17]
+
+
+@pytest.mark.parametrize('chunksize', CHUNKSIZES)
+@pytest.mark.parametrize('ensure_ascii', [True, False])
+@pytest.mark.parametrize('indent', [None, 1])
+@pytest.mark.parametrize('seekable', [True, False])
+@pytest.mark.parametrize('nb', [V4, V3], ids=['v4', 'v3'])
+def test_reader_matches_json(nb, seekable, indent, ensure_ascii, chunksize):
+    data = dumps(nb, ensure_ascii, indent)
+    reader = NotebookReader(io.BytesIO(data), seekable=seekable, chunksize=chunksize)
+    cells = list(reader)
+    expected = nb['cells'] if 'cells' in nb else nb['worksheets'][0]['cells']
+    assert len(cells) == len(expected)
+    for cell, exp in zip(cells, expected):
+        source = exp.get('source', exp.get('input'))
+        assert cell.cell_type == exp['cell_type']
+        assert ''.join(cell.source) == ''.join(source)
+        assert cell.metadata == exp['metadata']
+        assert cell.level == exp.get('level')
+        assert cell.execution_count == exp.get('execution_count', exp.get('prompt_number'))
+        assert cell.outputs == expected_outputs(exp.get('outputs', []))
+    assert reader.metadata['nbformat'] == nb['nbformat']
+
+
+def test_skipped_outputs():
+    data = dumps(V4, False, 1)
+    cells = list(NotebookReader(io.BytesIO(data), needs_outputs=lambda cell: False, chunksize=3))
+    assert [cell.outputs for cell in cells] == [[], [], [], []]
+    assert cells[2].source == V4['cells'][2]['source']
@@ -0,0 +1,68 @@
+import pytest
+
+enchant = pytest.importorskip('enchant')
+
+from ipythontools import spellchecker
+
+
+def checker():
+    return spellchecker.PrefetchingSpellChecker(spellchecker.get_dictionary('en_US'),
+                                                chunkers=[spellchecker.LatexChunker],
+                                                filters=[spellchecker.LatexCommandFilter])
+
+
+def test_chunker_skips_math_and_references():
+    tokenizer = spellchecker.get_tokenizer('en_US')
+    text = 'teh $x = wrods$ and \\ref{fig:teh}\n\\begin{equation}\nteh\n\\end{equation} wrods'
+    assert [word for word, pos in tokenizer(text)] == ['teh', 'and', 'wrods']
+
+
+def test_replace_continues_in_same_chunk():
+    chkr = checker()
+    chkr.set_text('teh stars teh and teh more wrods in a line')
+    asked = []
+    for err in chkr:
+        asked.append(err.word)
+        err.replace({'teh': 'the', 'wrods': 'words'}[err.word])
+    # Later instances of a corrected word are replaced without asking
+    assert asked == ['teh', 'wrods']
+    assert chkr.get_text() == 'the stars the and the more words in a line'
+
+
+def test_replace_across_lines_and_math():
+    chkr = checker()
+    chkr.set_text('teh raw \u00fc\nsecond line teh $teh$ teh')
+    for err in chkr:
+        if err.word == 'teh':
+            err.replace('the')
+    assert chkr.get_text() == 'the raw \u00fc\nsecond line the $teh$ the'
+
+
+def test_quit_is_recorded(monkeypatch, capsys):
+    chkr = checker()
+    cmdln = spellchecker.QuittingCmdLineChecker(chkr)
+    commands = iter(['i', 'i', 'q'])
+    monkeypatch.setattr('builtins.input', lambda prompt='': next(commands))
+    chkr.set_text('teh stars and wrods')
+    cmdln.run()
+    assert not cmdln.quit
+    chkr.set_text('teh stars and wrods')
+    cmdln.run()
+    assert cmdln.quit
+    # "q" leaves the rest of the text unchecked
+    assert chkr.word == 'teh'
+
+
+def test_dictionary_id_default_pwl(tmp_path, monkeypatch):
+    monkeypatch.setenv('ENCHANT_CONFIG_DIR', str(tmp_path))
+    dictionary = spellchecker.get_dictionary('en_US')
+    before = spellchecker.dictionary_id(dictionary)
+    assert before['pwl'] is None
+    (tmp_path / 'en_US.dic').write_text('wrods\n')
+    after = spellchecker.dictionary_id(dictionary)
+    assert after['pwl'] is not None
+    (tmp_path / 'en_US.exc').write_text('teh\n')
+    assert spellchecker.dictionary_id(dictionary)['pwl'] != after['pwl']
+    pwl = tmp_path / 'words.txt'
+    pwl.write_text('wrods\n')
+    assert spellchecker.dictionary_id(dictionary, str(pwl))['pwl'] != after['pwl']
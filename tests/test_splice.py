@@ -0,0 +1,100 @@
+import bz2
+import gzip
+import json
+import lzma
+
+import pytest
+
+from ipythontools.nbreader import NotebookReader, source_patches
+from ipythontools.fileutils import splice
+
+NB = {'cells': [
+    {'cell_type': 'markdown', 'metadata': {}, 'source': ['teh first line\n', 'second ü line']},
+    {'cell_type': 'raw', 'metadata': {}, 'source': 'a string\nwith teh lines'},
+    {'cell_type': 'code', 'execution_count': 1, 'metadata': {}, 'source': ['x = "teh"'],
+     'outputs': [{'output_type': 'stream', 'name': 'stdout', 'text': ['teh\n']}]},
+    {'cell_type': 'markdown', 'metadata': {}, 'source': ['unchanged\n', 'teh\n', 'end']}],
+    'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4}
+
+OPENERS = {'.gz': gzip.open, '.xz': lzma.open, '.bz2': bz2.open}
+
+
+def write(filename, nb, indent=1):
+    with OPENERS.get(filename.suffix, open)(str(filename), 'wb') as f:
+        f.write(json.dumps(nb, indent=indent, ensure_ascii=False).encode('utf-8'))
+
+
+def read(filename):
+    with OPENERS.get(filename.suffix, open)(str(filename), 'rb') as f:
+        return f.read()
+
+
+def correct(infile, outfile):
+    '''Replace "teh" in all markdown and raw cells, like the spell checker.'''
+    with open(str(infile), 'rb') as f:
+        reader = NotebookReader(f, needs_outputs=lambda cell: False, record_sources=True)
+        cells = list(reader)
+    patches = []
+    for cell, span in zip(cells, reader.source_spans):
+        if cell.cell_type in ('markdown', 'raw'):
+            new = ''.join(cell.source).replace('teh', 'the').splitlines(True)
+            patches.extend(source_patches(span, cell.source, new))
+    return splice(str(infile), str(outfile), patches)
+
+
+def expected(nb):
+    nb = json.loads(json.dumps(nb))
+    for cell in nb['cells']:
+        if cell['cell_type'] in ('markdown', 'raw'):
+            if isinstance(cell['source'], str):
+                cell['source'] = cell['source'].replace('teh', 'the')
+            else:
+                cell['source'] = [line.replace('teh', 'the') for line in cell['source']]
+    return nb
+
+
+@pytest.mark.parametrize('indent', [None, 1])
+@pytest.mark.parametrize('suffix', ['', '.gz', '.xz', '.bz2'])
+def test_splice_roundtrip(tmp_path, suffix, indent):
+    infile = tmp_path / ('nb.ipynb' + suffix)
+    outfile = tmp_path / 'out.ipynb'
+    write(infile, NB, indent)
+    assert correct(infile, outfile)
+    assert json.loads(read(outfile).decode('utf-8')) == expected(NB)
+    # Only the corrected strings change, the formatting stays as it was
+    assert read(outfile) == json.dumps(expected(NB), indent=indent,
+                                       ensure_ascii=False).encode('utf-8')
+
+
+def test_splice_in_place_and_unchanged(tmp_path):
+    infile = tmp_path / 'nb.ipynb'
+    write(infile, NB)
+    assert correct(infile, infile)
+    before = read(infile)
+    assert not correct(infile, infile)
+    assert read(infile) == before
+
+
+def test_source_patches_line_count_changes(tmp_path):
+    infile = tmp_path / 'nb.ipynb'
+    write(infile, NB)
+    with open(str(infile), 'rb') as f:
+        reader = NotebookReader(f, record_sources=True)
+        cells = list(reader)
+    patches = source_patches(reader.source_spans[0], cells[0].source, ['one line'])
+    patches += source_patches(reader.source_spans[1], cells[1].source, ['a string\n', 'more'])
+    outfile = tmp_path / 'out.ipynb'
+    splice(str(infile), str(outfile), patches)
+    nb = json.loads(read(outfile).decode('utf-8'))
+    assert nb['cells'][0]['source'] == ['one line']
+    # A source that was a single string stays a single string
+    assert nb['cells'][1]['source'] == 'a string\nmore'
+    assert nb['cells'][2:] == NB['cells'][2:]
+
+
+def test_splice_compresses_output(tmp_path):
+    infile = tmp_path / 'nb.ipynb.gz'
+    outfile = tmp_path / 'out.ipynb.xz'
+    write(infile, NB)
+    correct(infile, outfile)
+    assert json.loads(read(outfile).decode('utf-8')) == expected(NB)